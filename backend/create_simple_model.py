@@ -52,8 +52,9 @@ try:
     print("Modelo treinado com sucesso!")
     
     # Salvar com protocolo mais compatível
-    model_path = "ml/ml_model.pkl"
-    os.makedirs("ml", exist_ok=True)
+    # Caminho relativo ao script, não ao diretório de trabalho
+    model_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ml", "ml_model.pkl")
+    os.makedirs(os.path.dirname(model_path), exist_ok=True)
     
     # Tentar salvar com diferentes protocols
     joblib.dump(model, model_path, protocol=2)
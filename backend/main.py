@@ -2,20 +2,26 @@ import os
 from dotenv import load_dotenv
 load_dotenv() 
 from fastapi import FastAPI, HTTPException, Depends, Request, Response
+from fastapi.responses import StreamingResponse
 from typing import Dict, List, Any, Callable, Union, Awaitable, Optional
-from datetime import datetime
+from datetime import date, datetime, timedelta
+import asyncio
 import logging
-import unicodedata
-
-def normalize_city_name(city: str) -> str:
-    """
-    Remove acentos e normaliza o nome da cidade para compatibilidade com APIs externas.
-    Ex: 'São Paulo' -> 'Sao Paulo'
-    """
-    # Normaliza para forma NFD e remove os diacríticos
-    normalized = unicodedata.normalize('NFD', city)
-    ascii_city = ''.join(c for c in normalized if unicodedata.category(c) != 'Mn')
-    return ascii_city.strip()
+from services.iqv_service import build_iqv_result, estimate_traffic_delay, normalize_city_name
+from services.iqv_snapshot import IQV_COLUMNS, SNAPSHOT_REFRESH_SECONDS, get_snapshot, refresh_snapshot
+from services.leaderboard import leaderboard
+from services.spatial_index import spatial_index
+from services.alert_service import AlertDeduplicator, alert_store
+from services.notifications import alert_event, broadcaster, event_stream, iqv_event
+from services.forecast_table import forecast_table
+from ml.model_registry import ModelUnavailableError
+from services.http_cache import (
+    FORECAST_FRESHNESS_SECONDS,
+    WEATHER_FRESHNESS_SECONDS,
+    conditional_response,
+    make_etag,
+    remaining_freshness,
+)
 
 # Configurar logging
 logging.basicConfig(
@@ -66,34 +72,82 @@ async def options_handler(rest_of_path: str):
     return {"message": "OK"}
 RATE_LIMITING_ENABLED = False  # Desativado por enquanto devido a problemas com Pydantic v2
 
-# == FUNÇÕES E ENDPOINTS ==
+# == SNAPSHOT DE IQV EM MEMÓRIA ==
+
+alert_deduplicator = AlertDeduplicator()
 
-def calculate_iqv(temperature: float, humidity: float, traffic_delay: float = 0) -> Dict[str, float]:
+def publish_city_update(result: Dict[str, Any]) -> bool:
     """
-    Calcula o Índice de Qualidade de Vida (IQV) com base nos dados climáticos e de trânsito.
+    Propaga os dados mais recentes de uma cidade para os índices em memória.
+    Retorna True se o IQV da cidade mudou.
     """
-    # Cálculo do IQV Clima (baseado em temperatura)
-    temp_score = max(0, min(10, 10 - abs(temperature - 22.5) / 2.5))
-    # Cálculo do IQV Umidade (ideal: 40-60%)
-    humidity_score = max(0, min(10, 10 - abs(humidity - 50) / 5))
-    # Cálculo do IQV Trânsito (ideal: 0 minutos de atraso)
-    traffic_score = max(0, min(10, 10 - traffic_delay / 3))
-    # Cálculo do IQV Tendência 
-    trend_score = 5 + (22.5 - temperature) / 5
-    # Cálculo do IQV Geral (média ponderada)
-    iqv_overall = (
-        temp_score * 0.3 + 
-        humidity_score * 0.2 + 
-        traffic_score * 0.3 + 
-        trend_score * 0.2
-    )
-    return {
-        "iqv_climate": round(temp_score, 2),
-        "iqv_humidity": round(humidity_score, 2),
-        "iqv_traffic": round(traffic_score, 2),
-        "iqv_trend": round(trend_score, 2),
-        "iqv_overall": round(iqv_overall, 2)
-    }
+    changed = leaderboard.update(result)
+    spatial_index.update(result)
+    if changed:
+        # Apenas mudanças reais de IQV geram eventos para os clientes SSE
+        broadcaster.publish(iqv_event(result), result["city"])
+    return changed
+
+def publish_alerts(rows: List[Dict[str, Any]]):
+    """
+    Reavalia os alertas apenas das cidades cujas entradas mudaram (em um único
+    lote vetorizado) e envia os que não estão em cooldown.
+    """
+    for row, alerts in alert_store.refresh(rows):
+        for alert in alert_deduplicator.filter(row["city"], alerts):
+            broadcaster.publish(alert_event(row["city"], alert), row["city"])
+
+def publish_rows(rows: List[Dict[str, Any]]):
+    """Atualiza incrementalmente os índices derivados com um lote de cidades"""
+    for row in rows:
+        publish_city_update(row)
+    publish_alerts(rows)
+
+async def snapshot_refresh_loop():
+    """Reconstrói periodicamente o snapshot de IQV das cidades mais consultadas"""
+    while True:
+        try:
+            snapshot = await refresh_snapshot()
+            await asyncio.to_thread(publish_rows, snapshot.rows())
+        except Exception as e:
+            logger.error(f"Erro ao reconstruir snapshot de IQV: {str(e)}", exc_info=True)
+        await asyncio.sleep(SNAPSHOT_REFRESH_SECONDS)
+
+async def traffic_refresh_loop():
+    """Recalcula a tabela de trânsito quando o histórico Parquet muda"""
+    from services.traffic_service import TRAFFIC_CHECK_SECONDS, traffic_provider
+    while True:
+        try:
+            await asyncio.to_thread(traffic_provider.refresh_if_changed)
+        except Exception as e:
+            logger.error(f"Erro ao atualizar tabela de trânsito: {str(e)}", exc_info=True)
+        await asyncio.sleep(TRAFFIC_CHECK_SECONDS)
+
+async def model_refresh_loop():
+    """
+    Troca o modelo de IQV quando outra versão é promovida no registro ou quando
+    o ETL grava um novo checkpoint do modelo online (carga fora das requisições)
+    """
+    from pipelines.data_processing import get_predictor
+    refresh_seconds = int(os.getenv("MODEL_REFRESH_SECONDS", 30))
+    while True:
+        try:
+            predictor = await asyncio.to_thread(get_predictor)
+            await asyncio.to_thread(predictor.refresh_if_changed)
+        except Exception as e:
+            logger.error(f"Erro ao atualizar modelo de IQV: {str(e)}", exc_info=True)
+        await asyncio.sleep(refresh_seconds)
+
+@app.on_event("startup")
+async def start_snapshot_refresh():
+    broadcaster.attach_loop(asyncio.get_running_loop())
+    app.state.traffic_task = asyncio.create_task(traffic_refresh_loop())
+    if os.getenv("IQV_PREDICTOR", "registry").lower() in ("registry", "online"):
+        app.state.model_task = asyncio.create_task(model_refresh_loop())
+    if os.getenv("IQV_SNAPSHOT_ENABLED", "true").lower() == "true":
+        app.state.snapshot_task = asyncio.create_task(snapshot_refresh_loop())
+
+# == FUNÇÕES E ENDPOINTS ==
 
 @app.get("/api/iqv", 
          summary="Calcula o Índice de Qualidade de Vida Urbana",
@@ -101,39 +155,35 @@ def calculate_iqv(temperature: float, humidity: float, traffic_delay: float = 0)
                      "considerando temperatura, umidade, trânsito e tendências climáticas.",
          response_description="Dados do IQV calculados com sucesso",
          tags=["IQV"])
-async def get_iqv(city: str):
+async def get_iqv(city: str, request: Request, response: Response):
     print(f"Rota acessada para cidade: {city}")
     logger.info(f"Recebida solicitação para cidade: {city}")
     try:
         # Normaliza o nome da cidade
         city_normalized = normalize_city_name(city)
         logger.info(f"Cidade normalizada: {city_normalized}")
-        # Importar o serviço aqui para evitar problemas de importação circular
-        from services.weather_service import get_weather_data
-        # Obter dados climáticos
-        weather_data = get_weather_data(city_normalized)
-        # Simular dados de trânsito
-        large_cities = ["São Paulo", "Rio de Janeiro", "New York", "London", "Tokyo"]
-        avg_traffic_delay = 15.0 if weather_data["city"] in large_cities else 5.0
-        # Calcular IQV
-        iqv_data = calculate_iqv(
-            temperature=weather_data["temperature"],
-            humidity=weather_data["humidity"],
-            traffic_delay=avg_traffic_delay
-        )
-        # Combinar todos os dados
-        result = {
-            "city": weather_data["city"],
-            "country": weather_data["country"],
-            "updated_at": weather_data["updated_at"],
-            "temperature": weather_data["temperature"],
-            "description": weather_data["description"],
-            "humidity": weather_data["humidity"],
-            "avg_traffic_delay_min": avg_traffic_delay,
-            "latitude": weather_data["latitude"],  
-            "longitude": weather_data["longitude"],  
-            **iqv_data
-        }
+        # Cidades populares são servidas do snapshot em memória, sem chamada upstream
+        result = get_snapshot().get(city_normalized)
+        if result is not None:
+            weather_data = result
+            aqi, noise_db, traffic_delay = result["aqi"], result["noise_db"], result["avg_traffic_delay_min"]
+        else:
+            # Importar o serviço aqui para evitar problemas de importação circular
+            from services.weather_service import get_city_environment
+            # Obter clima (em cache) e, em paralelo, qualidade do ar e ruído
+            weather_data, aqi, noise_db = await get_city_environment(city_normalized)
+            traffic_delay = estimate_traffic_delay(weather_data)
+        # ETag derivado do `dt` do OpenWeather, conferido antes de montar o resultado
+        etag = make_etag(weather_data["city"], weather_data["updated_at"], traffic_delay, aqi, noise_db)
+        max_age = remaining_freshness(weather_data["updated_at"], WEATHER_FRESHNESS_SECONDS)
+        not_modified = conditional_response(request, response, etag, max_age)
+        if not_modified is not None:
+            return not_modified
+        if result is None:
+            # Combinar clima, trânsito (tabela pré-calculada), ar, ruído e IQV
+            result = build_iqv_result(weather_data, aqi, noise_db, avg_traffic_delay=traffic_delay)
+            publish_city_update(result)
+            publish_alerts([result])
         logger.info(f"Dados retornados para {city}: {result}")
         return result
     except ValueError as ve:
@@ -149,12 +199,71 @@ async def get_iqv(city: str):
             detail="Erro interno ao processar a solicitação"
         ) 
 
+@app.get("/api/ranking",
+         summary="Ranking de cidades pelo IQV",
+         description="Retorna o top-K (ou bottom-K) das cidades por um componente do IQV, "
+                     "com filtro por país e paginação, a partir de um índice mantido em memória.",
+         response_description="Cidades ordenadas pelo componente escolhido",
+         tags=["IQV"])
+async def get_ranking(by: str = "iqv_overall", limit: int = 20, offset: int = 0,
+                      order: str = "desc", country: Optional[str] = None):
+    """
+    Endpoint para obter o ranking das cidades com dados recentes.
+    """
+    if by not in IQV_COLUMNS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Parâmetro 'by' inválido. Use um de: {', '.join(IQV_COLUMNS)}"
+        )
+    page = leaderboard.query(
+        metric=by,
+        limit=min(limit, 100),
+        offset=offset,
+        ascending=order == "asc",
+        country=country
+    )
+    return {
+        "by": by,
+        "order": order,
+        "country": country,
+        "offset": offset,
+        **page
+    }
+
+@app.get("/api/map/cities",
+         summary="IQV das cidades dentro de uma área do mapa",
+         description="Retorna, em uma única consulta, todas as cidades com dados recentes dentro do "
+                     "retângulo informado. Use min_lon > max_lon para áreas que cruzam o antimeridiano.",
+         response_description="Cidades dentro da área visível",
+         tags=["IQV"])
+async def get_map_cities(min_lat: float, min_lon: float, max_lat: float, max_lon: float, limit: int = 500):
+    """
+    Endpoint para carregar o IQV de todas as cidades visíveis no mapa.
+    """
+    if min_lat > max_lat:
+        raise HTTPException(status_code=400, detail="min_lat deve ser menor ou igual a max_lat")
+    cities = spatial_index.within_bbox(min_lat, min_lon, max_lat, max_lon, limit=max(0, limit))
+    return {"count": len(cities), "cities": cities}
+
+@app.get("/api/map/nearest",
+         summary="Cidades mais próximas de um ponto",
+         description="Retorna as k cidades com dados recentes mais próximas das coordenadas informadas.",
+         response_description="Cidades ordenadas pela distância",
+         tags=["IQV"])
+async def get_nearest_cities(lat: float, lon: float, k: int = 5):
+    """
+    Endpoint para obter as cidades vizinhas a um ponto do mapa.
+    """
+    if not -90 <= lat <= 90 or not -180 <= lon <= 180:
+        raise HTTPException(status_code=400, detail="Coordenadas fora do intervalo válido")
+    return {"cities": spatial_index.nearest(lat, lon, k=min(max(0, k), 50))}
+
 @app.get("/api/forecast",
          summary="Obtém a previsão climática para uma cidade",
          description="Retorna a previsão climática para os próximos 7 dias de uma cidade específica.",
          response_description="Previsão climática para os próximos 7 dias",
          tags=["Previsão"])
-async def get_forecast(city: str):
+async def get_forecast(city: str, request: Request, response: Response):
     """
     Endpoint para obter a previsão climática para uma cidade específica.
     """
@@ -164,8 +273,13 @@ async def get_forecast(city: str):
         logger.info(f"Cidade normalizada: {city_normalized}")        
         from services.weather_service import get_forecast_data
         # Obter dados de previsão
-        forecast_data = get_forecast_data(city_normalized)
-              
+        forecast_data, updated_at = get_forecast_data(city_normalized)
+        # ETag e max-age derivados da rodada upstream (`list[0].dt`), não do conteúdo nem do relógio
+        etag = make_etag(city_normalized, updated_at)
+        max_age = remaining_freshness(updated_at, FORECAST_FRESHNESS_SECONDS)
+        not_modified = conditional_response(request, response, etag, max_age)
+        if not_modified is not None:
+            return not_modified
         return {"forecast": forecast_data}
     except ValueError as ve:
         logger.warning(f"Erro de validação para {city}: {str(ve)}")
@@ -180,6 +294,28 @@ async def get_forecast(city: str):
             detail="Erro interno ao processar a solicitação"
         )
 
+@app.get("/api/forecast/model",
+         summary="Obtém a previsão do modelo para uma cidade",
+         description="Retorna a previsão diária (yhat e intervalo) gerada pelo job de previsão por cidade, sem avaliar o modelo na requisição.",
+         response_description="Previsão do modelo por dia",
+         tags=["Previsão"])
+async def get_model_forecast(city: str, request: Request, response: Response,
+                             start: Optional[date] = None, end: Optional[date] = None):
+    """
+    Endpoint que serve as previsões pré-calculadas da tabela Arrow em memória.
+    Sem `start`, retorna a partir de hoje; `end` é inclusivo.
+    """
+    start = start or date.today()
+    end_exclusive = end + timedelta(days=1) if end else None
+    result = forecast_table.get_city(city, start=start, end=end_exclusive)
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"Previsão não disponível para '{city}'")
+    etag = make_etag(normalize_city_name(city), forecast_table.version(), start, end)
+    not_modified = conditional_response(request, response, etag, remaining_freshness(None, FORECAST_FRESHNESS_SECONDS))
+    if not_modified is not None:
+        return not_modified
+    return result
+
 @app.get("/api/debug",
          include_in_schema=False)
 async def debug_env():
@@ -196,6 +332,45 @@ async def debug_env():
         "python_version": os.popen("python --version").read().strip()
     }
 
+@app.get("/api/alerts",
+         summary="Alertas climáticos ativos",
+         description="Retorna os alertas ativos de uma cidade ou de todas as cidades com dados recentes, "
+                     "com filtros opcionais por tipo e severidade. Os alertas são servidos do armazenamento "
+                     "atualizado no ciclo de dados, sem recálculo.",
+         response_description="Alertas ativos",
+         tags=["IQV"])
+async def get_alerts(city: Optional[str] = None, type: Optional[str] = None, severity: Optional[str] = None):
+    """
+    Endpoint para consultar alertas climáticos por cidade ou globalmente.
+    """
+    if city is not None:
+        entry = alert_store.get_city(normalize_city_name(city))
+        if entry is None:
+            return {"city": city, "alerts": [], "evaluated_at": None}
+        entry["alerts"] = [
+            alert for alert in entry["alerts"]
+            if (type is None or alert["type"] == type) and (severity is None or alert["severity"] == severity)
+        ]
+        return entry
+    alerts = alert_store.query(alert_type=type, severity=severity)
+    return {"count": len(alerts), "alerts": alerts}
+
+@app.get("/api/notifications",
+         summary="Fluxo de notificações em tempo real",
+         description="Server-Sent Events com mudanças de IQV e alertas climáticos das cidades assinadas "
+                     "(parâmetro `cities` separado por vírgulas; omitido = todas).",
+         response_description="Fluxo text/event-stream",
+         tags=["Sistema"])
+async def notifications(request: Request, cities: Optional[str] = None):
+    """Endpoint SSE consumido pelo NotificationSystem do frontend"""
+    city_list = [city.strip() for city in cities.split(",") if city.strip()] if cities else None
+    subscriber = broadcaster.subscribe(city_list)
+    return StreamingResponse(
+        event_stream(broadcaster, subscriber, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/api/health",
          summary="Verifica a saúde da API",
          description="Endpoint para verificar se a API está funcionando corretamente.",
@@ -240,6 +415,12 @@ async def predict_iqv(city: str):
         }
         logger.info(f"Previsão gerada para {city}: {result}")
         return result
+    except ModelUnavailableError as e:
+        logger.error(f"Modelo indisponível para previsão de {city}: {str(e)}")
+        raise HTTPException(
+            status_code=503,
+            detail="Modelo de previsão indisponível"
+        )
     except Exception as e:
         logger.error(f"Erro ao gerar previsão para {city}: {str(e)}", exc_info=True)
         raise HTTPException(
@@ -247,6 +428,43 @@ async def predict_iqv(city: str):
             detail="Erro interno ao processar a previsão"
         )
 
+@app.post("/api/predict/iqv/batch",
+          summary="Prevê o IQV para um lote de cenários",
+          description=(
+              "Avalia muitos cenários (temperatura, umidade, atraso de trânsito e, opcionalmente, "
+              "day_of_week/month) em uma única chamada ao modelo. O corpo JSON aceita `columns` "
+              "(listas por coluna), `rows` (com `fields`) ou `grid` (produto cartesiano dos valores); "
+              "também aceita um stream Arrow IPC. A resposta é colunar, em JSON ou Arrow "
+              "(`format=arrow` ou Accept: application/vnd.apache.arrow.stream)."
+          ),
+          response_description="Colunas de entrada e IQV previsto por linha",
+          tags=["IQV"])
+async def predict_iqv_batch(request: Request, format: Optional[str] = None):
+    """
+    Endpoint de previsão em lote ("what-if") sem passar pelo pipeline por cidade.
+    """
+    from services.batch_prediction import ARROW_MEDIA_TYPE, InvalidBatchError, run_batch
+    from pipelines.data_processing import get_predictor
+    body = await request.body()
+    predictor = await asyncio.to_thread(get_predictor)
+    # Referência única ao modelo: uma troca de versão no meio do lote não o afeta
+    model, model_version = predictor.active_model()
+    if model is None:
+        raise HTTPException(status_code=503, detail="Modelo de previsão indisponível")
+
+    wants_arrow = format == "arrow" or ARROW_MEDIA_TYPE in request.headers.get("accept", "")
+    try:
+        # Decodificação, previsão e serialização em uma única ida ao pool de threads
+        content, media_type = await asyncio.to_thread(
+            run_batch, model, model_version, body, request.headers.get("content-type", ""), wants_arrow
+        )
+    except InvalidBatchError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    except Exception as e:
+        logger.error(f"Erro na previsão em lote ({len(body)} bytes): {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Erro interno ao processar a previsão")
+    return Response(content=content, media_type=media_type)
+
 @app.get("/api/ml/status",
          summary="Verifica o status do sistema de machine learning",
          description="Retorna informações sobre o estado atual do modelo de machine learning.",
@@ -262,6 +480,7 @@ async def ml_status():
             "ml_system": "active" if model_available else "inactive",
             "model_available": model_available,
             "model_path": pipeline.predictor.model_path,
+            "model_version": pipeline.predictor.active_model()[1],
             "timestamp": datetime.now().isoformat()
         }
     except Exception as e:
@@ -313,6 +532,8 @@ def home():
         "endpoints": [
             "/api/iqv?city=São%20Paulo",
             "/api/forecast?city=São%20Paulo",
+            "/api/forecast/model?city=São%20Paulo",
+            "/api/ranking?by=iqv_overall&limit=20",
             "/api/predict/iqv?city=São%20Paulo"
         ]
     }
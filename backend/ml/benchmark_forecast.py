@@ -0,0 +1,77 @@
+# backend/ml/benchmark_forecast.py
+"""
+Compara precisão e tempo dos previsores NumPy em lote com o Prophet no
+histórico gravado. Os últimos `horizon` dias de cada cidade ficam de fora do
+ajuste e servem de teste.
+
+Uso: python -m ml.benchmark_forecast --horizon 7 --prophet-cities 20
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from ml.forecast_iqv import load_history
+from ml.forecast_numpy import FORECASTERS, daily_matrix, forecast_matrix
+
+
+def errors(yhat, actual):
+    diff = yhat - actual
+    return float(np.mean(np.abs(diff))), float(np.sqrt(np.mean(diff ** 2)))
+
+
+def benchmark_numpy(backend, train, horizon):
+    started = time.perf_counter()
+    yhat, _, _ = forecast_matrix(train, horizon, backend)
+    return yhat, time.perf_counter() - started
+
+
+def benchmark_prophet(dates, train, horizon):
+    started = time.perf_counter()
+    import prophet  # noqa: F401
+    import_seconds = time.perf_counter() - started
+    from ml.forecast_iqv import fit_and_predict
+    yhat = np.empty((train.shape[0], horizon))
+    for i, series in enumerate(train):
+        forecast = fit_and_predict(pd.DataFrame({"ds": dates, "y": series}), periods=horizon)
+        yhat[i] = forecast["yhat"].to_numpy()[-horizon:]
+    return yhat, time.perf_counter() - started, import_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--horizon", type=int, default=7)
+    parser.add_argument("--prophet-cities", type=int, default=20,
+                        help="Cidades ajustadas com Prophet (0 para pular); a precisão é comparada nesse subconjunto")
+    args = parser.parse_args()
+
+    history = load_history()
+    if history.empty:
+        raise SystemExit("Histórico vazio: rode o ETL de clima antes do benchmark.")
+    cities, dates, values = daily_matrix(history)
+    if values.shape[1] <= args.horizon + 2:
+        raise SystemExit(f"Histórico curto demais ({values.shape[1]} dias) para o horizonte de {args.horizon} dias.")
+    train, test = values[:, :-args.horizon], values[:, -args.horizon:]
+    subset = slice(0, min(args.prophet_cities, len(cities))) if args.prophet_cities else slice(0, len(cities))
+    print(f"{len(cities)} cidades, {train.shape[1]} dias de treino, horizonte de {args.horizon} dias\n")
+
+    rows = []
+    for backend in FORECASTERS:
+        yhat, seconds = benchmark_numpy(backend, train, args.horizon)
+        mae, rmse = errors(yhat[subset], test[subset])
+        rows.append((backend, len(cities), seconds, mae, rmse))
+
+    if args.prophet_cities:
+        yhat, seconds, import_seconds = benchmark_prophet(dates[:-args.horizon], train[subset], args.horizon)
+        mae, rmse = errors(yhat, test[subset])
+        rows.append(("prophet", yhat.shape[0], seconds, mae, rmse))
+        print(f"Import do Prophet: {import_seconds:.2f}s")
+
+    print(f"{'backend':<10}{'cidades':>9}{'tempo (s)':>12}{'ms/cidade':>12}{'MAE':>8}{'RMSE':>8}")
+    for backend, n_cities, seconds, mae, rmse in rows:
+        print(f"{backend:<10}{n_cities:>9}{seconds:>12.3f}{1000 * seconds / n_cities:>12.2f}{mae:>8.2f}{rmse:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import json
+import os
+import shutil
+import uuid
+from pathlib import Path
+
+import numpy as np
+
+# Formato: diretório `<modelo>.flat/` com meta.json e um .npy por array.
+# Os .npy são abertos com mmap_mode="r": processos que carregam o mesmo modelo
+# compartilham as páginas somente-leitura pelo page cache do sistema.
+FLAT_FORMAT_VERSION = 1
+FLAT_ARRAYS = ("roots", "feature", "threshold", "left", "right", "missing_left", "value")
+# Limite de elementos (árvores × linhas) percorridos por vez na previsão em lote
+PREDICT_CHUNK_ELEMENTS = int(os.getenv("FLAT_PREDICT_CHUNK_ELEMENTS", 4_000_000))
+
+
+def _forest_arrays(model):
+    trees = [estimator.tree_ for estimator in model.estimators_]
+    sizes = np.array([tree.node_count for tree in trees])
+    offsets = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+
+    def offset_children(children, offset):
+        return np.where(children >= 0, children + offset, -1)
+
+    arrays = {
+        "roots": offsets.astype(np.int64),
+        "feature": np.concatenate([tree.feature for tree in trees]).astype(np.int32),
+        "threshold": np.concatenate([tree.threshold for tree in trees]).astype(np.float64),
+        "left": np.concatenate([offset_children(t.children_left, o) for t, o in zip(trees, offsets)]).astype(np.int64),
+        "right": np.concatenate([offset_children(t.children_right, o) for t, o in zip(trees, offsets)]).astype(np.int64),
+        "missing_left": np.zeros(int(sizes.sum()), dtype=bool),
+        "value": np.concatenate([tree.value[:, 0, 0] for tree in trees]).astype(np.float64),
+    }
+    return arrays, {"aggregate": "mean", "baseline": 0.0}
+
+
+def _hist_gbm_arrays(model):
+    if model._loss.__class__.__name__ != "HalfSquaredError":
+        raise ValueError("Exportação plana suporta apenas HistGradientBoostingRegressor com perda quadrática")
+    nodes = [predictor.nodes for iteration in model._predictors for predictor in iteration]
+    if any(node["is_categorical"].any() for node in nodes if "is_categorical" in node.dtype.names):
+        raise ValueError("Exportação plana não suporta features categóricas")
+    sizes = np.array([len(node) for node in nodes])
+    offsets = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+
+    def children(node, side, offset):
+        return np.where(node["is_leaf"].astype(bool), -1, node[side].astype(np.int64) + offset)
+
+    arrays = {
+        "roots": offsets.astype(np.int64),
+        "feature": np.concatenate([node["feature_idx"] for node in nodes]).astype(np.int32),
+        "threshold": np.concatenate([node["num_threshold"] for node in nodes]).astype(np.float64),
+        "left": np.concatenate([children(node, "left", o) for node, o in zip(nodes, offsets)]),
+        "right": np.concatenate([children(node, "right", o) for node, o in zip(nodes, offsets)]),
+        "missing_left": np.concatenate([node["missing_go_to_left"] for node in nodes]).astype(bool),
+        "value": np.concatenate([node["value"] for node in nodes]).astype(np.float64),
+    }
+    return arrays, {"aggregate": "sum", "baseline": float(np.ravel(model._baseline_prediction)[0])}
+
+
+class FlatTreeEnsemble:
+    """
+    Conjunto de árvores (RandomForest ou HistGradientBoosting) em arrays planos,
+    com todos os nós de todas as árvores concatenados. A previsão percorre as
+    árvores nível a nível, vetorizada sobre (árvores × linhas).
+    """
+
+    def __init__(self, arrays, aggregate="mean", baseline=0.0, n_features=None):
+        for name in FLAT_ARRAYS:
+            setattr(self, name, arrays[name])
+        self.aggregate = aggregate
+        self.baseline = baseline
+        self.n_features_in_ = n_features
+
+    @classmethod
+    def from_model(cls, model):
+        if hasattr(model, "estimators_"):
+            arrays, meta = _forest_arrays(model)
+        elif hasattr(model, "_predictors"):
+            arrays, meta = _hist_gbm_arrays(model)
+        else:
+            raise ValueError(f"Modelo não suportado na exportação plana: {type(model).__name__}")
+        return cls(arrays, n_features=getattr(model, "n_features_in_", None), **meta)
+
+    def _leaf_values(self, X):
+        n_trees, n_rows = len(self.roots), len(X)
+        node = np.repeat(self.roots[:, None], n_rows, axis=1)
+        rows = np.broadcast_to(np.arange(n_rows), node.shape)
+        active = self.left[node] >= 0
+        while active.any():
+            current = node[active]
+            x = X[rows[active], self.feature[current]]
+            go_left = (x <= self.threshold[current]) | (np.isnan(x) & self.missing_left[current])
+            node[active] = np.where(go_left, self.left[current], self.right[current])
+            active = self.left[node] >= 0
+        return self.value[node]
+
+    def predict(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        chunk = max(1, PREDICT_CHUNK_ELEMENTS // max(1, len(self.roots)))
+        result = np.empty(len(X))
+        for start in range(0, len(X), chunk):
+            values = self._leaf_values(X[start:start + chunk])
+            result[start:start + chunk] = values.mean(axis=0) if self.aggregate == "mean" else values.sum(axis=0)
+        return result + self.baseline
+
+
+def export_flat_model(model, path):
+    """Grava o modelo como diretório de arrays .npy; a troca do diretório final é atômica"""
+    flat = model if isinstance(model, FlatTreeEnsemble) else FlatTreeEnsemble.from_model(model)
+    path = Path(path)
+    tmp_dir = path.parent / f".{path.name}-{uuid.uuid4().hex}.tmp"
+    tmp_dir.mkdir(parents=True)
+    for name in FLAT_ARRAYS:
+        np.save(tmp_dir / f"{name}.npy", np.ascontiguousarray(getattr(flat, name)))
+    meta = {
+        "format_version": FLAT_FORMAT_VERSION,
+        "aggregate": flat.aggregate,
+        "baseline": flat.baseline,
+        "n_features": flat.n_features_in_,
+        "n_trees": int(len(flat.roots)),
+        "n_nodes": int(len(flat.value)),
+    }
+    (tmp_dir / "meta.json").write_text(json.dumps(meta, indent=2))
+    if path.exists():
+        # Renomear diretório sobre outro não é atômico: move o antigo de lado antes
+        old_dir = path.parent / f".{path.name}-{uuid.uuid4().hex}.old"
+        os.replace(path, old_dir)
+        os.replace(tmp_dir, path)
+        shutil.rmtree(old_dir, ignore_errors=True)
+    else:
+        os.replace(tmp_dir, path)
+    return path
+
+
+def load_flat_model(path, mmap_mode="r"):
+    """Abre o modelo plano; com mmap_mode="r" os arrays não são copiados para a memória do processo"""
+    path = Path(path)
+    meta = json.loads((path / "meta.json").read_text())
+    if meta["format_version"] != FLAT_FORMAT_VERSION:
+        raise ValueError(f"Versão de formato plano não suportada: {meta['format_version']}")
+    arrays = {name: np.load(path / f"{name}.npy", mmap_mode=mmap_mode) for name in FLAT_ARRAYS}
+    return FlatTreeEnsemble(arrays, aggregate=meta["aggregate"], baseline=meta["baseline"],
+                            n_features=meta["n_features"])
@@ -1,17 +1,68 @@
 # backend/ml/forecast_iqv.py
 import os
+import signal
+import logging
+import uuid
 import pandas as pd
-from prophet import Prophet
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime, timedelta
 import numpy as np
 from pathlib import Path
+from urllib.parse import quote
+from pipelines.parquet_history import ParquetHistory
+from ml.forecast_store import ForecastModelStore, series_fingerprint
+from ml.forecast_numpy import forecast_frames
+
+logger = logging.getLogger(__name__)
 
 DATA_DIR = Path(__file__).parent.parent / "data"
 INPUT_FILE = DATA_DIR / "weather_data.parquet"
+HISTORY_DIR = DATA_DIR / "weather_history"
 OUTPUT_FILE = DATA_DIR / "forecast.parquet"
+# Previsões por cidade, particionadas no estilo Hive (city=<nome>/forecast.parquet)
+FORECAST_DIR = DATA_DIR / "forecasts"
+# Todas as previsões por cidade consolidadas em Arrow IPC (memory-map na API)
+FORECAST_TABLE_FILE = DATA_DIR / "forecast.arrow"
+# Modelos ajustados por cidade + fingerprint dos dados de treino
+MODEL_STORE_DIR = Path(__file__).parent.parent / "models" / "forecast"
+# "prophet" (padrão) ou previsores em lote NumPy: "ets" (Holt-Winters) e "naive" (sazonal ingênuo)
+FORECAST_BACKEND = os.getenv("FORECAST_BACKEND", "prophet").lower()
+# Janela de histórico usada no treino (lê apenas as partições de data necessárias)
+HISTORY_DAYS = int(os.getenv("FORECAST_HISTORY_DAYS", 730))
+FORECAST_PERIODS = int(os.getenv("FORECAST_PERIODS", 7))
+# Processos do pool de previsão por cidade (padrão: todos os núcleos)
+FORECAST_MAX_WORKERS = int(os.getenv("FORECAST_MAX_WORKERS", os.cpu_count() or 1))
+# Tempo máximo de ajuste + previsão de uma cidade, em segundos
+FORECAST_CITY_TIMEOUT = int(os.getenv("FORECAST_CITY_TIMEOUT", 300))
+# Prophet exige ao menos duas observações
+MIN_HISTORY_POINTS = 2
+FORECAST_COLUMNS = ["ds", "yhat", "yhat_lower", "yhat_upper"]
+# Incrementar ao mudar a configuração do modelo invalida todos os fingerprints
+FORECAST_MODEL_VERSION = 1
+# Chave do modelo da série global (run_forecast) no repositório de modelos
+GLOBAL_SERIES_KEY = "__global__"
+
+model_store = ForecastModelStore(MODEL_STORE_DIR)
+
+def load_history(cities=None, days=HISTORY_DAYS):
+    """Lê (timestamp, temperatura) do histórico particionado, com poda por cidade e data."""
+    history = ParquetHistory(HISTORY_DIR)
+    start = datetime.now() - timedelta(days=days)
+    columns = ["city", "timestamp", "temperature"]
+    return history.read(columns=columns, cities=cities, start=start)
 
 def load_data():
     """Carrega dados reais ou gera simulados se insuficientes."""
+    df = load_history()
+    if len(df) >= 2:
+        df = df[["timestamp", "temperature"]].rename(columns={"timestamp": "ds", "temperature": "y"})
+        df["ds"] = pd.to_datetime(df["ds"])
+        return df.sort_values("ds").reset_index(drop=True)
+
+    # Arquivo legado (sobrescrito a cada execução antes do histórico particionado)
     if INPUT_FILE.exists():
         df = pd.read_parquet(INPUT_FILE)
         if len(df) >= 2:
@@ -27,23 +78,59 @@ def load_data():
     
     return pd.DataFrame({"ds": dates, "y": temperature})
 
+def build_model():
+    # Import tardio: carregar o Prophet (e o cmdstan) só quando o backend é usado
+    from prophet import Prophet
+    return Prophet(
+        yearly_seasonality=True,
+        weekly_seasonality=True,
+        daily_seasonality=False
+    )
+
+def warm_start_params(model):
+    """Parâmetros de um modelo ajustado no formato de `init` do Stan (warm start)."""
+    params = {}
+    for name in ["k", "m", "sigma_obs"]:
+        params[name] = model.params[name][0][0] if model.mcmc_samples == 0 else np.mean(model.params[name])
+    for name in ["delta", "beta"]:
+        params[name] = model.params[name][0] if model.mcmc_samples == 0 else np.mean(model.params[name], axis=0)
+    return params
+
+def fit_model(df, previous_model=None):
+    """
+    Ajusta um Prophet à série (ds, y). Com um modelo anterior (JSON), o otimizador
+    parte dos parâmetros dele; se as dimensões não forem compatíveis (ex.: número
+    de changepoints mudou), refaz o ajuste do zero.
+    """
+    if previous_model:
+        from prophet.serialize import model_from_json
+        try:
+            model = build_model()
+            model.fit(df, init=warm_start_params(model_from_json(previous_model)))
+            return model, True
+        except TimeoutError:
+            raise
+        except Exception as e:
+            logger.info(f"Warm start indisponível, ajustando do zero: {str(e)}")
+    model = build_model()
+    model.fit(df)
+    return model, False
+
+def predict(model, periods=FORECAST_PERIODS):
+    future = model.make_future_dataframe(periods=periods)
+    forecast = model.predict(future)
+    return forecast[FORECAST_COLUMNS]
+
+def fit_and_predict(df, periods=FORECAST_PERIODS):
+    """Ajusta um Prophet à série (ds, y) e prevê `periods` dias à frente."""
+    model, _ = fit_model(df)
+    return predict(model, periods)
+
 def train_and_forecast():
     """Treina modelo e gera previsão."""
     try:
         df = load_data()
-        
-        model = Prophet(
-            yearly_seasonality=True,
-            weekly_seasonality=True,
-            daily_seasonality=False
-        )
-        model.fit(df)
-        
-        future = model.make_future_dataframe(periods=7)
-        forecast = model.predict(future)
-        
-        return forecast[["ds", "yhat", "yhat_lower", "yhat_upper"]]
-    
+        return fit_and_predict(df)
     except Exception as e:
         raise RuntimeError(f"Erro no treinamento ou previsão: {e}")
 
@@ -60,14 +147,188 @@ def save_forecast(forecast):
         raise IOError(f"Erro ao salvar previsão: {e}")
 
 def run_forecast():
-    """Pipeline completo de previsão."""
+    """Pipeline completo de previsão. Não reajusta se a série não mudou desde o último ajuste."""
     try:
-        forecast = train_and_forecast()
+        df = load_data()
+        fingerprint = series_fingerprint(df, FORECAST_MODEL_VERSION, FORECAST_BACKEND, FORECAST_PERIODS)
+        entry = model_store.get(GLOBAL_SERIES_KEY)
+        if entry and entry["fingerprint"] == fingerprint and OUTPUT_FILE.exists():
+            return {"status": "unchanged", "updated_at": entry["fitted_at"]}
+
+        if FORECAST_BACKEND != "prophet":
+            series = df.rename(columns={"ds": "timestamp", "y": "temperature"}).assign(city=GLOBAL_SERIES_KEY)
+            forecast = forecast_frames(series, FORECAST_PERIODS, backend=FORECAST_BACKEND)[GLOBAL_SERIES_KEY]
+            save_forecast(forecast)
+            # O fingerprint inclui o backend: uma execução Prophet posterior não o confunde com este
+            model_store.save(GLOBAL_SERIES_KEY, fingerprint, None, backend=FORECAST_BACKEND)
+            return {
+                "status": "success",
+                "backend": FORECAST_BACKEND,
+                "forecast_length": len(forecast),
+                "updated_at": datetime.now().isoformat()
+            }
+
+        from prophet.serialize import model_to_json
+        model, warm_started = fit_model(df, model_store.load_model(GLOBAL_SERIES_KEY))
+        forecast = predict(model)
         save_forecast(forecast)
+        model_store.save(GLOBAL_SERIES_KEY, fingerprint, model_to_json(model))
         return {
             "status": "success",
             "forecast_length": len(forecast),
+            "warm_started": warm_started,
             "updated_at": datetime.now().isoformat()
         }
     except Exception as e:
-        return {"status": "error", "message": str(e)}
\ No newline at end of file
+        return {"status": "error", "message": str(e)}
+
+def _raise_timeout(signum, frame):
+    raise TimeoutError("tempo limite de previsão excedido")
+
+def forecast_city(city, df, periods=FORECAST_PERIODS, timeout=FORECAST_CITY_TIMEOUT, previous_model=None):
+    """
+    Executado em um processo do pool: ajusta (com warm start a partir de
+    `previous_model`, se houver) e prevê uma cidade. Retorna (previsão, modelo
+    em JSON, warm start?), já serializado para voltar ao processo pai. O tempo limite
+    é aplicado dentro do próprio processo (SIGALRM), liberando o worker para as
+    próximas cidades em vez de deixá-lo preso a um ajuste que não converge.
+    """
+    use_alarm = hasattr(signal, "SIGALRM") and timeout
+    if use_alarm:
+        previous = signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.alarm(timeout)
+    try:
+        from prophet.serialize import model_to_json
+        model, warm_started = fit_model(df, previous_model)
+        return predict(model, periods), model_to_json(model), warm_started
+    finally:
+        if use_alarm:
+            signal.alarm(0)
+            signal.signal(signal.SIGALRM, previous)
+
+def city_series(history):
+    """Separa o histórico em uma série (ds, y) ordenada por cidade."""
+    series = {}
+    for city, group in history.groupby("city", sort=True):
+        df = group[["timestamp", "temperature"]].rename(columns={"timestamp": "ds", "temperature": "y"})
+        df["ds"] = pd.to_datetime(df["ds"])
+        series[city] = df.dropna().sort_values("ds").reset_index(drop=True)
+    return series
+
+def city_forecast_path(city):
+    return FORECAST_DIR / f"city={quote(str(city), safe='')}" / "forecast.parquet"
+
+def save_city_forecast(city, forecast, generated_at=None):
+    """Substitui atomicamente a partição de previsão da cidade."""
+    partition_dir = city_forecast_path(city).parent
+    partition_dir.mkdir(parents=True, exist_ok=True)
+    forecast_df = forecast.copy()
+    forecast_df["ds"] = pd.to_datetime(forecast_df["ds"])
+    forecast_df["generated_at"] = pd.Timestamp(generated_at or datetime.now())
+    table = pa.Table.from_pandas(forecast_df, preserve_index=False)
+    tmp_path = partition_dir / f".forecast-{uuid.uuid4().hex}.tmp"
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, city_forecast_path(city))
+
+def export_forecast_table():
+    """
+    Consolida as partições de previsão em um único arquivo Arrow IPC ordenado por
+    cidade e data, substituído atomicamente. A API abre esse arquivo por
+    memory-map e indexa as faixas de linhas de cada cidade.
+    """
+    if not FORECAST_DIR.exists():
+        return 0
+    partitioning = ds.partitioning(pa.schema([("city", pa.string())]), flavor="hive")
+    dataset = ds.dataset(str(FORECAST_DIR), format="parquet", partitioning=partitioning,
+                         exclude_invalid_files=True)
+    table = dataset.to_table().sort_by([("city", "ascending"), ("ds", "ascending")])
+    tmp_path = FORECAST_TABLE_FILE.parent / f".forecast-table-{uuid.uuid4().hex}.tmp"
+    with pa.OSFile(str(tmp_path), "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, FORECAST_TABLE_FILE)
+    return table.num_rows
+
+def run_batched_forecasts(cities=None, periods=FORECAST_PERIODS, backend=FORECAST_BACKEND):
+    """Previsão de todas as cidades de uma vez com um previsor NumPy (sem processos nem Prophet)."""
+    started_at = datetime.now()
+    history = load_history(cities)
+    forecasts = forecast_frames(history, periods, backend=backend) if not history.empty else {}
+    series = city_series(history) if forecasts else {}
+    for city, forecast in forecasts.items():
+        save_city_forecast(city, forecast, generated_at=started_at)
+        # Só metadados: registra que a partição atual veio deste backend, e não de um ajuste Prophet
+        if city in series:
+            fingerprint = series_fingerprint(series[city], FORECAST_MODEL_VERSION, backend, periods)
+            model_store.save(city, fingerprint, None, backend=backend)
+    if forecasts or not FORECAST_TABLE_FILE.exists():
+        export_forecast_table()
+    return {
+        "status": "success",
+        "backend": backend,
+        "cities_forecasted": sorted(forecasts),
+        "duration_seconds": round((datetime.now() - started_at).total_seconds(), 2),
+        "updated_at": datetime.now().isoformat()
+    }
+
+def run_city_forecasts(cities=None, max_workers=FORECAST_MAX_WORKERS, timeout=FORECAST_CITY_TIMEOUT,
+                       periods=FORECAST_PERIODS):
+    """
+    Previsão por cidade em um ProcessPoolExecutor (um ajuste de Prophet por
+    processo). Falhas e estouros de tempo ficam isolados na cidade afetada;
+    as demais previsões são gravadas normalmente. Cidades cuja série não mudou
+    desde o último ajuste (mesmo fingerprint) mantêm a previsão já gravada.
+    Com FORECAST_BACKEND diferente de "prophet", usa o previsor NumPy em lote.
+    """
+    if FORECAST_BACKEND != "prophet":
+        return run_batched_forecasts(cities, periods)
+
+    started_at = datetime.now()
+    series = city_series(load_history(cities))
+    ready = {city: df for city, df in series.items() if len(df) >= MIN_HISTORY_POINTS}
+    succeeded, warm_started, unchanged, failed = [], [], [], {}
+
+    pending = {}
+    for city, df in ready.items():
+        fingerprint = series_fingerprint(df, FORECAST_MODEL_VERSION, FORECAST_BACKEND, periods)
+        entry = model_store.get(city)
+        if entry and entry["fingerprint"] == fingerprint and city_forecast_path(city).exists():
+            unchanged.append(city)
+        else:
+            pending[city] = (df, fingerprint)
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=max(1, min(max_workers, len(pending)))) as executor:
+            futures = {
+                executor.submit(forecast_city, city, df, periods, timeout, model_store.load_model(city)): city
+                for city, (df, _) in pending.items()
+            }
+            for future in as_completed(futures):
+                city = futures[future]
+                try:
+                    forecast, model_json, warm = future.result()
+                    save_city_forecast(city, forecast, generated_at=started_at)
+                    model_store.save(city, pending[city][1], model_json)
+                    succeeded.append(city)
+                    if warm:
+                        warm_started.append(city)
+                except Exception as e:
+                    logger.warning(f"Falha na previsão de {city}: {str(e)}")
+                    failed[city] = str(e)
+
+    if succeeded or not FORECAST_TABLE_FILE.exists():
+        export_forecast_table()
+
+    return {
+        "status": "success" if not failed else ("partial" if succeeded else "error"),
+        "cities_forecasted": sorted(succeeded),
+        "cities_warm_started": sorted(warm_started),
+        "cities_unchanged": sorted(unchanged),
+        "cities_failed": failed,
+        "cities_skipped": sorted(set(series) - set(ready)),
+        "duration_seconds": round((datetime.now() - started_at).total_seconds(), 2),
+        "updated_at": datetime.now().isoformat()
+    }
+
+if __name__ == "__main__":
+    print(run_city_forecasts())
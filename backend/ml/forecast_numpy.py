@@ -0,0 +1,128 @@
+# backend/ml/forecast_numpy.py
+"""
+Previsores leves em NumPy (Holt-Winters aditivo e sazonal ingênuo) que ajustam
+todas as cidades de uma vez: as séries diárias formam uma matriz cidades × dias
+e cada passo de tempo é uma operação vetorizada sobre todas elas.
+"""
+import os
+from itertools import product
+
+import numpy as np
+import pandas as pd
+
+# Sazonalidade semanal em séries diárias
+SEASON_LENGTH = 7
+# Grade de parâmetros avaliada em paralelo; cada cidade fica com a de menor erro
+ALPHAS = (0.1, 0.3, 0.5, 0.8)
+BETAS = (0.0, 0.05)
+GAMMAS = (0.05, 0.2)
+# Quantil normal do intervalo de previsão (~80%, como o padrão do Prophet)
+INTERVAL_Z = float(os.getenv("FORECAST_INTERVAL_Z", 1.28))
+
+
+def daily_matrix(history, value_column="temperature"):
+    """
+    Agrega o histórico (city, timestamp, valor) em médias diárias e monta a
+    matriz cidades × dias. Lacunas são preenchidas com o último valor
+    conhecido (e o início da série com o primeiro).
+    """
+    df = history[["city", "timestamp", value_column]].dropna()
+    df = df.assign(date=pd.to_datetime(df["timestamp"]).dt.floor("D"))
+    daily = df.pivot_table(index="city", columns="date", values=value_column, aggfunc="mean")
+    daily = daily.reindex(columns=pd.date_range(daily.columns.min(), daily.columns.max(), freq="D"))
+    daily = daily.ffill(axis=1).bfill(axis=1)
+    return daily.index.to_list(), daily.columns, daily.to_numpy(dtype=float)
+
+
+def _holt_winters(values, alpha, beta, gamma, season):
+    """
+    Holt-Winters aditivo sobre `values` (cidades × dias) para K combinações de
+    parâmetros ao mesmo tempo; `alpha`, `beta` e `gamma` têm forma (K, 1).
+    Retorna nível, tendência, sazonalidade e a soma dos erros quadráticos um passo à frente.
+    """
+    n_series, n_steps = values.shape
+    shape = (alpha.shape[0], n_series)
+    level = np.broadcast_to(values[:, :season].mean(axis=1), shape).copy()
+    if n_steps >= 2 * season:
+        slope = (values[:, season:2 * season].mean(axis=1) - values[:, :season].mean(axis=1)) / season
+    else:
+        slope = np.zeros(n_series)
+    trend = np.broadcast_to(slope, shape).copy()
+    seasonal = np.broadcast_to(values[:, :season] - values[:, :season].mean(axis=1, keepdims=True),
+                               shape + (season,)).copy()
+    sse = np.zeros(shape)
+
+    for t in range(n_steps):
+        y = values[:, t]
+        s = seasonal[..., t % season]
+        error = y - (level + trend + s)
+        if t >= season:
+            sse += error ** 2
+        new_level = alpha * (y - s) + (1 - alpha) * (level + trend)
+        trend = beta * (new_level - level) + (1 - beta) * trend
+        seasonal[..., t % season] = gamma * (y - new_level) + (1 - gamma) * s
+        level = new_level
+    return level, trend, seasonal, sse
+
+
+def holt_winters_forecast(values, horizon, season=SEASON_LENGTH):
+    """
+    Ajusta Holt-Winters a todas as séries, escolhendo por série a combinação de
+    parâmetros da grade com menor erro um passo à frente. Retorna (yhat, sigma)
+    com formas (cidades × horizon) e (cidades,).
+    """
+    n_series, n_steps = values.shape
+    if n_steps < 2 * season:
+        # Histórico curto demais para estimar a sazonalidade
+        season = 1
+    grid = np.array(list(product(ALPHAS, BETAS, GAMMAS if season > 1 else (0.0,))))
+    alpha, beta, gamma = (grid[:, i:i + 1] for i in range(3))
+    level, trend, seasonal, sse = _holt_winters(values, alpha, beta, gamma, season)
+
+    best = sse.argmin(axis=0)
+    series = np.arange(n_series)
+    level, trend, seasonal = level[best, series], trend[best, series], seasonal[best, series]
+    sigma = np.sqrt(sse[best, series] / max(1, n_steps - season))
+
+    steps = np.arange(1, horizon + 1)
+    season_index = (n_steps + steps - 1) % season
+    yhat = level[:, None] + steps[None, :] * trend[:, None] + seasonal[:, season_index]
+    return yhat, sigma
+
+
+def seasonal_naive_forecast(values, horizon, season=SEASON_LENGTH):
+    """Repete o último ciclo sazonal; sigma vem das diferenças sazonais do histórico."""
+    n_steps = values.shape[1]
+    season = min(season, n_steps)
+    steps = np.arange(horizon)
+    yhat = values[:, n_steps - season + steps % season]
+    if n_steps > season:
+        sigma = np.std(values[:, season:] - values[:, :-season], axis=1)
+    else:
+        sigma = np.zeros(values.shape[0])
+    return yhat, sigma
+
+
+FORECASTERS = {
+    "ets": holt_winters_forecast,
+    "naive": seasonal_naive_forecast,
+}
+
+
+def forecast_matrix(values, horizon, backend="ets"):
+    """Previsão em lote; retorna (yhat, yhat_lower, yhat_upper), cada um cidades × horizon."""
+    yhat, sigma = FORECASTERS[backend](values, horizon)
+    # A incerteza cresce com o horizonte (aproximação de passeio aleatório)
+    spread = INTERVAL_Z * sigma[:, None] * np.sqrt(np.arange(1, horizon + 1))[None, :]
+    return yhat, yhat - spread, yhat + spread
+
+
+def forecast_frames(history, horizon, backend="ets", value_column="temperature"):
+    """Previsão de todas as cidades do histórico; retorna {cidade: DataFrame(ds, yhat, yhat_lower, yhat_upper)}."""
+    cities, dates, values = daily_matrix(history, value_column)
+    yhat, lower, upper = forecast_matrix(values, horizon, backend)
+    future = pd.date_range(dates[-1] + pd.Timedelta(days=1), periods=horizon, freq="D")
+    return {
+        city: pd.DataFrame({"ds": future, "yhat": yhat[i], "yhat_lower": lower[i], "yhat_upper": upper[i]})
+        for i, city in enumerate(cities)
+    }
@@ -0,0 +1,65 @@
+import hashlib
+import json
+import logging
+import os
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Optional
+from urllib.parse import quote
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+def series_fingerprint(df: pd.DataFrame, *config: Any) -> str:
+    """Hash estável do conteúdo da série (ds, y) e da configuração do modelo"""
+    digest = hashlib.sha256(pd.util.hash_pandas_object(df[["ds", "y"]], index=False).values.tobytes())
+    digest.update(json.dumps(config, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ForecastModelStore:
+    """
+    Modelos de previsão ajustados, um por cidade, com o fingerprint dos dados
+    usados no ajuste. Os metadados ficam separados do modelo serializado para
+    que a checagem de "dados inalterados" não precise ler o modelo inteiro.
+    """
+
+    def __init__(self, base_dir: Path):
+        self.base_dir = Path(base_dir)
+
+    def _path(self, city: str, suffix: str) -> Path:
+        return self.base_dir / f"{quote(str(city), safe='')}.{suffix}.json"
+
+    def _write(self, path: Path, content: str) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.parent / f".{path.name}-{uuid.uuid4().hex}.tmp"
+        tmp_path.write_text(content, encoding="utf-8")
+        os.replace(tmp_path, path)
+
+    def get(self, city: str) -> Optional[Dict[str, Any]]:
+        """Metadados do último ajuste da cidade (fingerprint, data do ajuste), ou None"""
+        path = self._path(city, "meta")
+        if not path.exists():
+            return None
+        try:
+            return json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Metadados de modelo inválidos para {city}: {str(e)}")
+            return None
+
+    def load_model(self, city: str) -> Optional[str]:
+        """Modelo serializado (JSON) do último ajuste da cidade, ou None"""
+        path = self._path(city, "model")
+        return path.read_text(encoding="utf-8") if path.exists() else None
+
+    def save(self, city: str, fingerprint: str, model_json: Optional[str], **extra: Any) -> None:
+        # Modelo antes dos metadados: um fingerprint gravado sempre tem modelo correspondente.
+        # Backends sem modelo serializável (NumPy) passam None e gravam só os metadados,
+        # preservando o último modelo Prophet para warm start
+        if model_json is not None:
+            self._write(self._path(city, "model"), model_json)
+        meta = {"city": city, "fingerprint": fingerprint, "fitted_at": datetime.now().isoformat(), **extra}
+        self._write(self._path(city, "meta"), json.dumps(meta))
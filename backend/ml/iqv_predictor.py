@@ -1,7 +1,9 @@
 import joblib
+import numpy as np
 import pandas as pd
+import pyarrow.dataset as ds
 import datetime
-from sklearn.ensemble import RandomForestRegressor
+from sklearn.ensemble import HistGradientBoostingRegressor, RandomForestRegressor
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import mean_squared_error
 import os
@@ -9,58 +11,160 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+FEATURE_COLUMNS = ['temperature', 'humidity', 'traffic_delay',
+                   'temp_humidity_interaction', 'is_weekend', 'season']
+TARGET_COLUMN = 'iqv_overall'
+# Linhas lidas por lote ao treinar a partir de Parquet
+TRAIN_BATCH_SIZE = int(os.getenv("IQV_TRAIN_BATCH_SIZE", 250_000))
+
+# Perfis de treino: trocam precisão por tamanho do modelo e latência de previsão.
+# Compare-os nos dados reais com `python -m ml.profile_report`.
+TRAINING_PROFILES = {
+    # Configuração original: árvores sem limite de profundidade
+    "full": {"estimator": "forest", "n_estimators": 100, "max_depth": None, "min_samples_leaf": 1},
+    "balanced": {"estimator": "forest", "n_estimators": 50, "max_depth": 14, "min_samples_leaf": 4},
+    "compact": {"estimator": "forest", "n_estimators": 20, "max_depth": 8, "min_samples_leaf": 16},
+    # Gradient boosting por histograma: poucas árvores rasas, modelo pequeno
+    "hist_gbm": {"estimator": "hist_gbm", "max_iter": 200, "max_leaf_nodes": 31, "learning_rate": 0.1},
+}
+DEFAULT_TRAINING_PROFILE = os.getenv("IQV_TRAINING_PROFILE", "full")
+
+
+def build_estimator(profile=DEFAULT_TRAINING_PROFILE):
+    """Cria o regressor (ainda não treinado) do perfil de treino"""
+    if profile not in TRAINING_PROFILES:
+        raise ValueError(f"Perfil de treino desconhecido: {profile}. Opções: {', '.join(TRAINING_PROFILES)}")
+    params = dict(TRAINING_PROFILES[profile])
+    if params.pop("estimator") == "hist_gbm":
+        return HistGradientBoostingRegressor(random_state=42, **params)
+    return RandomForestRegressor(random_state=42, n_jobs=-1, **params)
+
+
+def for_serving(model):
+    """
+    Desliga o paralelismo usado no treino (n_jobs=-1): em previsões de uma linha
+    ou lotes pequenos, acionar um pool de threads por chamada só adiciona latência.
+    """
+    if getattr(model, "n_jobs", None) is not None:
+        model.n_jobs = 1
+    return model
+
+# Tabelas de consulta indexadas pelo mês (1-12) e pelo dia da semana (0 = segunda)
+SEASON_BY_MONTH = np.array([-1, 0, 0, 1, 1, 1, 2, 2, 2, 3, 3, 3, 0])  # 0 Verão, 1 Outono, 2 Inverno, 3 Primavera
+WEEKEND_BY_WEEKDAY = np.array([0, 0, 0, 0, 0, 1, 1])
+
+
+def build_features(df):
+    """
+    Monta a matriz de features (float32, na ordem de FEATURE_COLUMNS) de forma
+    vetorizada. Sem `day_of_week`/`month`, deriva ambos de `timestamp`.
+    """
+    if 'day_of_week' in df and 'month' in df:
+        day_of_week = np.asarray(df['day_of_week'], dtype=np.int64)
+        month = np.asarray(df['month'], dtype=np.int64)
+    else:
+        timestamp = pd.to_datetime(df['timestamp'])
+        day_of_week = timestamp.dt.dayofweek.to_numpy()
+        month = timestamp.dt.month.to_numpy()
+    temperature = np.asarray(df['temperature'], dtype=np.float32)
+    humidity = np.asarray(df['humidity'], dtype=np.float32)
+    return np.column_stack([
+        temperature,
+        humidity,
+        np.asarray(df['traffic_delay'], dtype=np.float32),
+        temperature * humidity,
+        WEEKEND_BY_WEEKDAY[day_of_week],
+        SEASON_BY_MONTH[month]
+    ]).astype(np.float32)
+
+
+def iter_parquet_batches(source, batch_size=TRAIN_BATCH_SIZE):
+    """Lê um arquivo ou diretório Parquet em lotes de até `batch_size` linhas (DataFrames)"""
+    dataset = ds.dataset(str(source), format="parquet", partitioning="hive")
+    wanted = ['temperature', 'humidity', 'traffic_delay', 'day_of_week', 'month', 'timestamp', TARGET_COLUMN]
+    columns = [column for column in wanted if column in dataset.schema.names]
+    for batch in dataset.to_batches(columns=columns, batch_size=batch_size):
+        yield batch.to_pandas()
+
 class IQVPredictor:
-    def __init__(self, model_path=None):
+    def __init__(self, model_path=None, profile=DEFAULT_TRAINING_PROFILE):
         self.model = None
         self.model_path = model_path
+        self.profile = profile
         self.is_trained = False
         
         if model_path and os.path.exists(model_path):
             try:
-                self.model = joblib.load(model_path)
+                if os.path.isdir(model_path):
+                    # Modelo exportado em arrays planos (ml.flat_model), aberto por memory-map
+                    from ml.flat_model import load_flat_model
+                    self.model = load_flat_model(model_path)
+                else:
+                    self.model = joblib.load(model_path)
                 self.is_trained = True
                 logger.info(f"Modelo carregado com sucesso de {model_path}")
             except Exception as e:
                 logger.error(f"Erro ao carregar modelo de {model_path}: {str(e)}")
     
     def train(self, historical_data):
-        """Treina o modelo com dados históricos"""
+        """Treina o modelo com dados históricos (lista de dicts ou DataFrame)"""
         try:
             df = pd.DataFrame(historical_data)
-            
-            # Cria features relevantes
-            df['temp_humidity_interaction'] = df['temperature'] * df['humidity']
-            df['is_weekend'] = df['day_of_week'].apply(lambda x: 1 if x >= 5 else 0)
-            df['season'] = df['month'].apply(self._get_season)
-            
-            # Prepara dados para treinamento
-            X = df[['temperature', 'humidity', 'traffic_delay', 
-                   'temp_humidity_interaction', 'is_weekend', 'season']]
-            y = df['iqv_overall']
-            
-            X_train, X_test, y_train, y_test = train_test_split(
-                X, y, test_size=0.2, random_state=42
-            )
-            
-            self.model = RandomForestRegressor(n_estimators=100, random_state=42)
-            self.model.fit(X_train, y_train)
-            y_pred = self.model.predict(X_test)
-            rmse = mean_squared_error(y_test, y_pred, squared=False)
-            
-            logger.info(f"Modelo treinado com RMSE: {rmse:.2f}")
-            self.is_trained = True
-            
-            # Salva o modelo treinado
-            if self.model_path:
-                os.makedirs(os.path.dirname(self.model_path), exist_ok=True)
-                joblib.dump(self.model, self.model_path)
-                logger.info(f"Modelo salvo em {self.model_path}")
-            
-            return rmse
+            return self._fit(build_features(df), df[TARGET_COLUMN].to_numpy(dtype=np.float32))
         except Exception as e:
             logger.error(f"Erro no treinamento do modelo: {str(e)}")
             raise
-    
+
+    def train_from_parquet(self, source, batch_size=TRAIN_BATCH_SIZE):
+        """
+        Treina a partir de um arquivo/diretório Parquet lido em lotes: cada lote
+        vira direto um bloco float32 de features, sem passar por dicts Python.
+        """
+        try:
+            feature_blocks, target_blocks = [], []
+            for batch in iter_parquet_batches(source, batch_size):
+                feature_blocks.append(build_features(batch))
+                target_blocks.append(batch[TARGET_COLUMN].to_numpy(dtype=np.float32))
+            if not feature_blocks:
+                raise ValueError(f"Nenhum dado de treino em {source}")
+            return self._fit(np.concatenate(feature_blocks), np.concatenate(target_blocks))
+        except Exception as e:
+            logger.error(f"Erro no treinamento do modelo: {str(e)}")
+            raise
+
+    def _fit(self, X, y):
+        X_train, X_test, y_train, y_test = train_test_split(
+            X, y, test_size=0.2, random_state=42
+        )
+
+        self.model = build_estimator(self.profile)
+        for_serving(self.model.fit(X_train, y_train))
+        y_pred = self.model.predict(X_test)
+        rmse = float(np.sqrt(mean_squared_error(y_test, y_pred)))
+
+        logger.info(f"Modelo treinado com RMSE: {rmse:.2f} ({len(X)} linhas, perfil {self.profile})")
+        self.is_trained = True
+
+        # Salva o modelo treinado
+        if self.model_path:
+            os.makedirs(os.path.dirname(self.model_path), exist_ok=True)
+            if str(self.model_path).endswith(".flat"):
+                self.export_flat(self.model_path)
+            else:
+                joblib.dump(self.model, self.model_path)
+            logger.info(f"Modelo salvo em {self.model_path}")
+
+        return rmse
+
+    def export_flat(self, path):
+        """
+        Exporta o modelo em arrays planos memory-mappable: vários workers que
+        carregam o mesmo diretório compartilham as páginas em vez de cada um
+        ter sua cópia da floresta.
+        """
+        from ml.flat_model import export_flat_model
+        return export_flat_model(self.model, path)
+
     def predict(self, current_data):
         """Faz previsões para novos dados"""
         if not self.is_trained:
@@ -68,32 +172,31 @@ class IQVPredictor:
             return 7.5  # Valor padrão se o modelo não estiver treinado
         
         try:
-            # Cria features para previsão
-            current_date = datetime.datetime.now()
-            features = pd.DataFrame([{
-                'temperature': current_data['temperature'],
-                'humidity': current_data['humidity'],
-                'traffic_delay': current_data['traffic_delay'],
-                'temp_humidity_interaction': current_data['temperature'] * current_data['humidity'],
-                'is_weekend': 1 if current_date.weekday() >= 5 else 0,
-                'season': self._get_season(current_date.month)
-            }])
-            
-            return float(self.model.predict(features)[0])
+            return self._predict_with(self.model, current_data)
         except Exception as e:
             logger.error(f"Erro na previsão: {str(e)}")
             return 7.5  # Valor padrão em caso de erro
+
+    @staticmethod
+    def _predict_with(model, current_data):
+        """Previsão de uma linha com o modelo informado (erros são propagados)"""
+        current_date = datetime.datetime.now()
+        features = build_features({
+            'temperature': [current_data['temperature']],
+            'humidity': [current_data['humidity']],
+            'traffic_delay': [current_data['traffic_delay']],
+            'day_of_week': [current_date.weekday()],
+            'month': [current_date.month]
+        })
+        return float(model.predict(features)[0])
+
+    def active_model(self):
+        """Par (modelo, versão) em uso, lido de uma só vez; versão None fora do registro"""
+        return self.model, None
     
     def _get_season(self, month):
         """Determina a estação do ano com base no mês"""
-        if month in [12, 1, 2]:
-            return 0  # Verão
-        elif month in [3, 4, 5]:
-            return 1  # Outono
-        elif month in [6, 7, 8]:
-            return 2  # Inverno
-        else:
-            return 3  # Primavera
+        return int(SEASON_BY_MONTH[month])
     
     def is_model_available(self):
         """Verifica se o modelo está disponível para uso"""
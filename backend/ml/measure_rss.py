@@ -0,0 +1,105 @@
+# backend/ml/measure_rss.py
+"""
+Mede a memória por worker ao carregar o modelo de IQV em N processos: pickle
+(joblib.load, uma cópia por processo) vs. arrays planos com memory-map
+(páginas compartilhadas pelo page cache). Reporta RSS e PSS (Linux), antes e
+depois de carregar o modelo e prever um lote; PSS divide as páginas
+compartilhadas entre os processos que as usam.
+
+Uso:
+    python -m ml.measure_rss --workers 4                        # treina uma floresta sintética
+    python -m ml.measure_rss --workers 8 --model models/iqv_predictor.pkl
+"""
+import argparse
+import multiprocessing as mp
+import os
+import tempfile
+
+import joblib
+import numpy as np
+
+
+def memory_kb():
+    """(RSS, PSS) do processo atual em KB; PSS só está disponível no Linux"""
+    rss = pss = None
+    try:
+        with open("/proc/self/status") as f:
+            rss = next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+        with open("/proc/self/smaps_rollup") as f:
+            pss = next(int(line.split()[1]) for line in f if line.startswith("Pss:"))
+    except (OSError, StopIteration):
+        import resource
+        rss = rss or resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss, pss
+
+
+def worker(model_format, path, X, barrier, results):
+    from ml.flat_model import load_flat_model
+    before = memory_kb()
+    model = load_flat_model(path) if model_format == "flat" else joblib.load(path)
+    model.predict(X)
+    # Todos os workers vivos ao mesmo tempo, para o PSS refletir o compartilhamento
+    barrier.wait()
+    after = memory_kb()
+    barrier.wait()
+    results.put((model_format, before, after))
+
+
+def measure(model_format, path, n_workers, X):
+    context = mp.get_context("spawn")
+    barrier = context.Barrier(n_workers)
+    results = context.Queue()
+    processes = [context.Process(target=worker, args=(model_format, path, X, barrier, results))
+                 for _ in range(n_workers)]
+    for process in processes:
+        process.start()
+    rows = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return rows
+
+
+def prepare_models(model_path, tmp_dir):
+    from ml.flat_model import export_flat_model
+    if model_path:
+        model = joblib.load(model_path)
+    else:
+        from ml.iqv_predictor import TARGET_COLUMN, build_estimator, build_features, for_serving
+        from ml.profile_report import synthetic_training_data
+        df = synthetic_training_data(50_000)
+        model = for_serving(build_estimator("full").fit(build_features(df), df[TARGET_COLUMN].to_numpy()))
+    pickle_path = os.path.join(tmp_dir, "model.pkl")
+    joblib.dump(model, pickle_path)
+    flat_path = export_flat_model(model, os.path.join(tmp_dir, "model.flat"))
+    return model, pickle_path, str(flat_path)
+
+
+def summarize(rows):
+    rss_before = np.mean([before[0] for _, before, _ in rows])
+    rss_after = np.mean([after[0] for _, _, after in rows])
+    pss_values = [after[1] - before[1] for _, before, after in rows if after[1] is not None and before[1] is not None]
+    return rss_before, rss_after, (sum(pss_values) if pss_values else None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--model", help="Modelo joblib existente (padrão: floresta sintética com o perfil full)")
+    parser.add_argument("--rows", type=int, default=1000, help="Linhas previstas por worker para tocar as páginas")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        model, pickle_path, flat_path = prepare_models(args.model, tmp_dir)
+        n_features = getattr(model, "n_features_in_", 6)
+        X = np.random.default_rng(0).normal(size=(args.rows, n_features)).astype(np.float32)
+        print(f"Modelo: {os.path.getsize(pickle_path) / 2**20:.1f} MB em pickle; {args.workers} workers\n")
+        print(f"{'formato':<8}{'RSS antes (MB)':>16}{'RSS depois (MB)':>17}{'Δ RSS/worker (MB)':>19}{'Δ PSS total (MB)':>18}")
+        for model_format, path in (("pickle", pickle_path), ("flat", flat_path)):
+            rss_before, rss_after, pss_total = summarize(measure(model_format, path, args.workers, X))
+            pss = f"{pss_total / 1024:>18.1f}" if pss_total is not None else f"{'n/d':>18}"
+            print(f"{model_format:<8}{rss_before / 1024:>16.1f}{rss_after / 1024:>17.1f}"
+                  f"{(rss_after - rss_before) / 1024:>19.1f}{pss}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+# backend/ml/model_registry.py
+"""
+Registro local de modelos de IQV com versões imutáveis:
+
+    models/registry/<nome>/versions/<versão>/{model.pkl | model.flat/, manifest.json}
+    models/registry/<nome>/current -> versions/<versão>
+
+O manifesto guarda features, versões de sklearn/numpy, checksum do artefato e
+métricas. A promoção troca o symlink `current` atomicamente (os.replace).
+
+Uso:
+    python -m ml.model_registry train --data data/iqv_training --profile hist_gbm --promote
+    python -m ml.model_registry register models/iqv_predictor.pkl
+    python -m ml.model_registry promote <versão>
+    python -m ml.model_registry list
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+import joblib
+import numpy as np
+import sklearn
+
+from ml.iqv_predictor import DEFAULT_TRAINING_PROFILE, FEATURE_COLUMNS, TRAINING_PROFILES, IQVPredictor
+
+logger = logging.getLogger(__name__)
+
+REGISTRY_DIR = Path(os.getenv("IQV_REGISTRY_DIR", Path(__file__).parent.parent / "models" / "registry"))
+DEFAULT_MODEL_NAME = "iqv"
+MANIFEST_FILE = "manifest.json"
+
+
+class ModelUnavailableError(RuntimeError):
+    """Nenhuma versão promovida pôde ser carregada"""
+
+
+def artifact_checksum(path):
+    """SHA-256 do artefato (arquivo ou diretório, em ordem de nome)"""
+    path = Path(path)
+    digest = hashlib.sha256()
+    files = sorted(p for p in path.rglob("*") if p.is_file()) if path.is_dir() else [path]
+    for file in files:
+        digest.update(file.relative_to(path).as_posix().encode() if path.is_dir() else b"")
+        with open(file, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+class ModelRegistry:
+    def __init__(self, base_dir=REGISTRY_DIR):
+        self.base_dir = Path(base_dir).resolve()
+
+    def _model_dir(self, name):
+        return self.base_dir / name
+
+    def version_dir(self, name, version):
+        return self._model_dir(name) / "versions" / version
+
+    def register(self, model, name=DEFAULT_MODEL_NAME, metrics=None, profile=None, model_format="joblib"):
+        """Grava uma nova versão imutável do modelo e retorna o identificador da versão"""
+        versions_dir = self._model_dir(name) / "versions"
+        versions_dir.mkdir(parents=True, exist_ok=True)
+        tmp_dir = versions_dir / f".tmp-{uuid.uuid4().hex}"
+        tmp_dir.mkdir()
+        try:
+            if model_format == "flat":
+                from ml.flat_model import export_flat_model
+                artifact = "model.flat"
+                export_flat_model(model, tmp_dir / artifact)
+            else:
+                artifact = "model.pkl"
+                joblib.dump(model, tmp_dir / artifact)
+            checksum = artifact_checksum(tmp_dir / artifact)
+            version = f"{datetime.now():%Y%m%d%H%M%S}-{checksum[:8]}"
+            manifest = {
+                "name": name,
+                "version": version,
+                "created_at": datetime.now().isoformat(),
+                "model_class": type(model).__name__,
+                "profile": profile,
+                "features": FEATURE_COLUMNS,
+                "sklearn_version": sklearn.__version__,
+                "numpy_version": np.__version__,
+                "format": model_format,
+                "artifact": artifact,
+                "checksum": checksum,
+                "metrics": metrics or {},
+            }
+            (tmp_dir / MANIFEST_FILE).write_text(json.dumps(manifest, indent=2))
+            os.replace(tmp_dir, versions_dir / version)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        logger.info(f"Modelo {name} registrado na versão {version}")
+        return version
+
+    def manifest(self, name, version):
+        return json.loads((self.version_dir(name, version) / MANIFEST_FILE).read_text())
+
+    def list_versions(self, name=DEFAULT_MODEL_NAME):
+        versions_dir = self._model_dir(name) / "versions"
+        if not versions_dir.exists():
+            return []
+        return sorted(p.name for p in versions_dir.iterdir() if not p.name.startswith("."))
+
+    def current_version(self, name=DEFAULT_MODEL_NAME):
+        """Versão apontada por `current`, ou None se nada foi promovido"""
+        try:
+            return Path(os.readlink(self._model_dir(name) / "current")).name
+        except (FileNotFoundError, OSError):
+            return None
+
+    def promote(self, version, name=DEFAULT_MODEL_NAME):
+        """Verifica o checksum e aponta `current` para a versão com uma troca atômica do symlink"""
+        self.verify(name, version)
+        link = self._model_dir(name) / "current"
+        tmp_link = self._model_dir(name) / f".current-{uuid.uuid4().hex}"
+        os.symlink(Path("versions") / version, tmp_link)
+        os.replace(tmp_link, link)
+        logger.info(f"Modelo {name}: versão {version} promovida")
+
+    def verify(self, name, version):
+        manifest = self.manifest(name, version)
+        checksum = artifact_checksum(self.version_dir(name, version) / manifest["artifact"])
+        if checksum != manifest["checksum"]:
+            raise ValueError(f"Checksum inválido para {name}/{version}")
+        return manifest
+
+    def load(self, name=DEFAULT_MODEL_NAME, version=None):
+        """Carrega (modelo, manifesto) da versão indicada ou da promovida"""
+        version = version or self.current_version(name)
+        if version is None:
+            raise ModelUnavailableError(f"Nenhuma versão promovida para o modelo {name}")
+        manifest = self.verify(name, version)
+        if manifest["sklearn_version"] != sklearn.__version__:
+            logger.warning(f"Modelo {name}/{version} treinado com sklearn {manifest['sklearn_version']}, "
+                           f"carregado com {sklearn.__version__}")
+        path = self.version_dir(name, version) / manifest["artifact"]
+        if manifest["format"] == "flat":
+            from ml.flat_model import load_flat_model
+            model = load_flat_model(path)
+        else:
+            model = joblib.load(path)
+        return model, manifest
+
+
+class RegistryPredictor(IQVPredictor):
+    """
+    IQVPredictor servido a partir da versão promovida no registro. A troca de
+    versão carrega o novo modelo fora do caminho das requisições
+    (`refresh_if_changed`) e substitui a referência de uma vez: requisições em
+    andamento terminam com o modelo anterior, e uma falha de carga mantém a
+    versão atual em uso em vez de cair para um valor padrão.
+    """
+
+    def __init__(self, registry=None, name=DEFAULT_MODEL_NAME):
+        self.registry = registry or ModelRegistry()
+        self.name = name
+        self.profile = None
+        self._active = (None, None)
+        self._reload_lock = threading.Lock()
+        try:
+            self.refresh_if_changed()
+        except Exception as e:
+            logger.error(f"Erro ao carregar modelo {name} do registro: {str(e)}")
+
+    @property
+    def model(self):
+        return self._active[0]
+
+    @model.setter
+    def model(self, model):
+        self._active = (model, None)
+
+    @property
+    def is_trained(self):
+        return self._active[0] is not None
+
+    @is_trained.setter
+    def is_trained(self, value):
+        pass
+
+    @property
+    def manifest(self):
+        return self._active[1]
+
+    @property
+    def version(self):
+        return self.manifest["version"] if self.manifest else None
+
+    @property
+    def model_path(self):
+        if self.manifest is None:
+            return None
+        return str(self.registry.version_dir(self.name, self.version) / self.manifest["artifact"])
+
+    @model_path.setter
+    def model_path(self, value):
+        pass
+
+    def refresh_if_changed(self):
+        """Carrega a versão promovida se ela mudou; retorna True se houve troca"""
+        current = self.registry.current_version(self.name)
+        if current is None or current == self.version:
+            return False
+        with self._reload_lock:
+            if current == self.version:
+                return False
+            self._active = self.registry.load(self.name, current)
+            logger.info(f"Modelo {self.name} trocado para a versão {current}")
+            return True
+
+    def active_model(self):
+        model, manifest = self._active
+        return model, manifest["version"] if manifest else None
+
+    def predict(self, current_data):
+        # Sem o valor padrão do IQVPredictor: falhas de previsão chegam ao endpoint como erro
+        model, _ = self.active_model()
+        if model is None:
+            raise ModelUnavailableError(f"Nenhuma versão do modelo {self.name} carregada")
+        return self._predict_with(model, current_data)
+
+
+_registry_predictor = None
+_registry_predictor_lock = threading.Lock()
+
+
+def get_registry_predictor():
+    """Instância compartilhada no processo (cada worker mantém e troca a sua)"""
+    global _registry_predictor
+    with _registry_predictor_lock:
+        if _registry_predictor is None:
+            _registry_predictor = RegistryPredictor()
+        return _registry_predictor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--name", default=DEFAULT_MODEL_NAME)
+    commands = parser.add_subparsers(dest="command", required=True)
+    train = commands.add_parser("train", help="Treina, registra e opcionalmente promove")
+    train.add_argument("--data", required=True, help="Arquivo/diretório Parquet com features brutas e iqv_overall")
+    train.add_argument("--profile", default=DEFAULT_TRAINING_PROFILE, choices=list(TRAINING_PROFILES))
+    train.add_argument("--format", default="joblib", choices=["joblib", "flat"])
+    train.add_argument("--promote", action="store_true")
+    register = commands.add_parser("register", help="Registra um modelo joblib existente")
+    register.add_argument("path")
+    register.add_argument("--promote", action="store_true")
+    promote = commands.add_parser("promote", help="Promove uma versão registrada")
+    promote.add_argument("version")
+    commands.add_parser("list", help="Lista as versões registradas")
+    args = parser.parse_args()
+
+    registry = ModelRegistry()
+    if args.command == "train":
+        predictor = IQVPredictor(profile=args.profile)
+        rmse = predictor.train_from_parquet(args.data)
+        version = registry.register(predictor.model, args.name, metrics={"rmse": rmse},
+                                    profile=args.profile, model_format=args.format)
+    elif args.command == "register":
+        version = registry.register(joblib.load(args.path), args.name)
+    elif args.command == "promote":
+        registry.promote(args.version, args.name)
+        print(f"{args.name}: {args.version} promovida")
+        return
+    else:
+        current = registry.current_version(args.name)
+        for version in registry.list_versions(args.name):
+            manifest = registry.manifest(args.name, version)
+            marker = "*" if version == current else " "
+            print(f"{marker} {version}  {manifest['model_class']:<32}{manifest['format']:<8}{manifest['metrics']}")
+        return
+
+    print(f"{args.name}: versão {version} registrada")
+    if args.promote:
+        registry.promote(version, args.name)
+        print(f"{args.name}: {version} promovida")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import joblib
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from sklearn.linear_model import SGDRegressor
+from sklearn.metrics import mean_squared_error
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import StandardScaler
+import os
+import threading
+import logging
+
+from ml.iqv_predictor import TARGET_COLUMN, TRAIN_BATCH_SIZE, IQVPredictor, build_features, iter_parquet_batches
+
+logger = logging.getLogger(__name__)
+
+ONLINE_MODEL_PATH = os.getenv(
+    "IQV_ONLINE_MODEL_PATH", str(Path(__file__).parent.parent / "models" / "iqv_online.pkl")
+)
+# Número de atualizações incrementais entre checkpoints em disco
+CHECKPOINT_EVERY = int(os.getenv("IQV_ONLINE_CHECKPOINT_EVERY", 10))
+# Passadas sobre os dados em um treino completo (train / _fit)
+FULL_TRAIN_EPOCHS = 5
+MINI_BATCH_SIZE = 1024
+
+
+class OnlineIQVModel:
+    """
+    Regressão linear com SGD sobre as features do IQVPredictor (mais os
+    quadrados de temperatura, umidade e trânsito, que capturam a penalidade
+    por distância do ideal). Padronização e pesos são atualizados por lote
+    com `partial_fit`; `predict` recebe a mesma matriz que o RandomForest.
+    """
+
+    def __init__(self, alpha=1e-4, eta0=0.01, random_state=42):
+        self.scaler = StandardScaler()
+        self.regressor = SGDRegressor(alpha=alpha, eta0=eta0, learning_rate="invscaling", random_state=random_state)
+        self.n_samples_seen_ = 0
+
+    @staticmethod
+    def _expand(X):
+        return np.hstack([X, X[:, :3] ** 2])
+
+    def partial_fit(self, X, y):
+        X = self._expand(X)
+        self.scaler.partial_fit(X)
+        self.regressor.partial_fit(self.scaler.transform(X), y)
+        self.n_samples_seen_ += len(X)
+        return self
+
+    def predict(self, X):
+        return self.regressor.predict(self.scaler.transform(self._expand(X)))
+
+
+class OnlineIQVPredictor(IQVPredictor):
+    """
+    Variante do IQVPredictor com aprendizado incremental: cada lote de
+    observações do ETL atualiza o modelo em O(lote), sem retreinar sobre todo
+    o histórico. O modelo é salvo (atomicamente) a cada `checkpoint_every` atualizações
+    e recarregado por outros processos quando o checkpoint muda (`refresh_if_changed`).
+    """
+
+    def __init__(self, model_path=ONLINE_MODEL_PATH, checkpoint_every=CHECKPOINT_EVERY):
+        super().__init__(model_path)
+        self.checkpoint_every = checkpoint_every
+        self._updates_since_checkpoint = 0
+        self._lock = threading.Lock()
+        self._checkpoint_mtime = self._stat_mtime()
+
+    def _stat_mtime(self):
+        try:
+            return os.stat(self.model_path).st_mtime_ns if self.model_path else None
+        except FileNotFoundError:
+            return None
+
+    def refresh_if_changed(self):
+        """
+        Recarrega o checkpoint se outro processo (ex.: o ETL de clima) o regravou.
+        A carga acontece antes de trocar a referência, fora das requisições.
+        Retorna True se houve troca.
+        """
+        mtime = self._stat_mtime()
+        if mtime is None or mtime == self._checkpoint_mtime:
+            return False
+        model = joblib.load(self.model_path)
+        with self._lock:
+            self.model = model
+            self.is_trained = True
+            self._checkpoint_mtime = mtime
+            self._updates_since_checkpoint = 0
+        logger.info(f"Modelo online recarregado de {self.model_path}")
+        return True
+
+    def update(self, observations):
+        """
+        Atualiza o modelo com um lote de observações (features brutas + iqv_overall).
+        Retorna o RMSE do lote medido antes da atualização (avaliação prequencial),
+        ou None se o modelo ainda não tinha sido treinado.
+        """
+        df = pd.DataFrame(observations)
+        if df.empty:
+            return None
+        X = build_features(df)
+        y = df[TARGET_COLUMN].to_numpy(dtype=np.float32)
+        with self._lock:
+            rmse = None
+            if self.model is None:
+                self.model = OnlineIQVModel()
+            elif self.is_trained:
+                rmse = float(np.sqrt(mean_squared_error(y, self.model.predict(X))))
+            self.model.partial_fit(X, y)
+            self.is_trained = True
+            self._updates_since_checkpoint += 1
+            if self._updates_since_checkpoint >= self.checkpoint_every:
+                self._checkpoint()
+        logger.info(f"Modelo online atualizado com {len(df)} observações"
+                    + (f" (RMSE prequencial: {rmse:.2f})" if rmse is not None else ""))
+        return rmse
+
+    def checkpoint(self):
+        with self._lock:
+            self._checkpoint()
+
+    def _checkpoint(self):
+        if not self.model_path or self.model is None:
+            return
+        os.makedirs(os.path.dirname(self.model_path), exist_ok=True)
+        tmp_path = f"{self.model_path}.tmp"
+        joblib.dump(self.model, tmp_path)
+        os.replace(tmp_path, self.model_path)
+        self._updates_since_checkpoint = 0
+        self._checkpoint_mtime = self._stat_mtime()
+        logger.info(f"Checkpoint do modelo online salvo em {self.model_path}")
+
+    def train_from_parquet(self, source, batch_size=TRAIN_BATCH_SIZE):
+        """Treina lote a lote a partir de Parquet; a memória fica limitada a um lote"""
+        try:
+            rmses = [rmse for rmse in (self.update(batch) for batch in iter_parquet_batches(source, batch_size))
+                     if rmse is not None]
+            self.checkpoint()
+            return float(np.mean(rmses)) if rmses else None
+        except Exception as e:
+            logger.error(f"Erro no treinamento do modelo online: {str(e)}")
+            raise
+
+    def _fit(self, X, y):
+        """Treino completo do zero: algumas passadas em mini-lotes embaralhados"""
+        X_train, X_test, y_train, y_test = train_test_split(
+            X, y, test_size=0.2, random_state=42
+        )
+        model = OnlineIQVModel()
+        rng = np.random.default_rng(42)
+        for _ in range(FULL_TRAIN_EPOCHS):
+            order = rng.permutation(len(X_train))
+            for start in range(0, len(order), MINI_BATCH_SIZE):
+                rows = order[start:start + MINI_BATCH_SIZE]
+                model.partial_fit(X_train[rows], y_train[rows])
+        rmse = float(np.sqrt(mean_squared_error(y_test, model.predict(X_test))))
+
+        with self._lock:
+            self.model = model
+            self.is_trained = True
+            self._checkpoint()
+        logger.info(f"Modelo online treinado com RMSE: {rmse:.2f} ({len(X)} linhas)")
+        return rmse
+
+
+_online_predictor = None
+_online_predictor_lock = threading.Lock()
+
+
+def get_online_predictor():
+    """Instância compartilhada no processo (atualizada pelo ETL ou recarregada pela API)"""
+    global _online_predictor
+    with _online_predictor_lock:
+        if _online_predictor is None:
+            _online_predictor = OnlineIQVPredictor()
+        return _online_predictor
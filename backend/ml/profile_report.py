@@ -0,0 +1,145 @@
+# backend/ml/profile_report.py
+"""
+Relatório dos perfis de treino do IQVPredictor: RMSE, tamanho do modelo
+serializado, tempo de carga e latência p50/p99 de previsão (uma linha e em lote).
+Todos os perfis usam a mesma divisão treino/teste.
+
+Uso:
+    python -m ml.profile_report                       # dados sintéticos rotulados por calculate_iqv
+    python -m ml.profile_report --data data/iqv_training --json report.json
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.metrics import mean_squared_error
+from sklearn.model_selection import train_test_split
+
+from ml.iqv_predictor import (
+    TARGET_COLUMN, TRAINING_PROFILES, build_estimator, build_features, for_serving, iter_parquet_batches
+)
+from services.iqv_service import calculate_iqv
+
+
+def synthetic_training_data(n_rows, seed=42):
+    """Observações sintéticas com o IQV calculado pela mesma fórmula da API"""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "temperature": rng.normal(22, 8, n_rows).round(1),
+        "humidity": rng.uniform(20, 100, n_rows).round(0),
+        "traffic_delay": rng.gamma(2.0, 6.0, n_rows).round(1),
+        "timestamp": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 365 * 24, n_rows), unit="h")
+    })
+    df[TARGET_COLUMN] = [
+        calculate_iqv(t, h, d)["iqv_overall"]
+        for t, h, d in zip(df["temperature"], df["humidity"], df["traffic_delay"])
+    ]
+    return df
+
+
+def load_training_data(source, n_rows):
+    batches, total = [], 0
+    for batch in iter_parquet_batches(source):
+        batches.append(batch)
+        total += len(batch)
+        if total >= n_rows:
+            break
+    if not batches:
+        raise SystemExit(f"Nenhum dado de treino em {source}")
+    return pd.concat(batches, ignore_index=True).head(n_rows)
+
+
+def percentiles_ms(samples):
+    samples = np.asarray(samples) * 1000
+    return float(np.percentile(samples, 50)), float(np.percentile(samples, 99))
+
+
+def timed(function, repeats):
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def profile_model(profile, X_train, X_test, y_train, y_test, batch_size, single_calls, batch_calls):
+    model = build_estimator(profile)
+    started = time.perf_counter()
+    model.fit(X_train, y_train)
+    train_seconds = time.perf_counter() - started
+    # Mesma configuração do modelo servido: latências sem o pool de threads do treino
+    for_serving(model)
+    rmse = float(np.sqrt(mean_squared_error(y_test, model.predict(X_test))))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, f"{profile}.pkl")
+        joblib.dump(model, path)
+        model_bytes = os.path.getsize(path)
+        load_seconds = float(np.median(timed(lambda: joblib.load(path), 3)))
+
+    rows = np.resize(np.arange(len(X_test)), max(single_calls, batch_size))
+    single = [X_test[i:i + 1] for i in rows[:single_calls]]
+    calls = iter(single)
+    single_p50, single_p99 = percentiles_ms(timed(lambda: model.predict(next(calls)), single_calls))
+    batch = X_test[rows[:batch_size]]
+    batch_samples = timed(lambda: model.predict(batch), batch_calls)
+    batch_p50, batch_p99 = percentiles_ms(batch_samples)
+
+    return {
+        "profile": profile,
+        "rmse": round(rmse, 4),
+        "train_seconds": round(train_seconds, 2),
+        "model_bytes": model_bytes,
+        "load_ms": round(load_seconds * 1000, 2),
+        "single_p50_ms": round(single_p50, 3),
+        "single_p99_ms": round(single_p99, 3),
+        "batch_size": batch_size,
+        "batch_p50_ms": round(batch_p50, 2),
+        "batch_p99_ms": round(batch_p99, 2),
+        "batch_rows_per_second": int(batch_size / np.median(batch_samples))
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", help="Arquivo/diretório Parquet com features brutas e iqv_overall")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--profiles", nargs="+", default=list(TRAINING_PROFILES), choices=list(TRAINING_PROFILES))
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument("--single-calls", type=int, default=300)
+    parser.add_argument("--batch-calls", type=int, default=20)
+    parser.add_argument("--json", help="Grava o relatório neste arquivo")
+    args = parser.parse_args()
+
+    df = load_training_data(args.data, args.rows) if args.data else synthetic_training_data(args.rows)
+    X = build_features(df)
+    y = df[TARGET_COLUMN].to_numpy(dtype=np.float32)
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    print(f"{len(df)} linhas ({len(X_train)} treino / {len(X_test)} teste)\n")
+
+    report = [
+        profile_model(profile, X_train, X_test, y_train, y_test, args.batch_size, args.single_calls, args.batch_calls)
+        for profile in args.profiles
+    ]
+
+    print(f"{'perfil':<10}{'RMSE':>8}{'treino (s)':>12}{'tamanho (KB)':>14}{'carga (ms)':>12}"
+          f"{'1 linha p50/p99 (ms)':>24}{'lote p50/p99 (ms)':>20}{'linhas/s':>12}")
+    for row in report:
+        print(f"{row['profile']:<10}{row['rmse']:>8.3f}{row['train_seconds']:>12.2f}{row['model_bytes'] / 1024:>14.0f}"
+              f"{row['load_ms']:>12.1f}{row['single_p50_ms']:>13.2f} / {row['single_p99_ms']:<8.2f}"
+              f"{row['batch_p50_ms']:>10.1f} / {row['batch_p99_ms']:<7.1f}{row['batch_rows_per_second']:>12}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nRelatório salvo em {args.json}")
+
+
+if __name__ == "__main__":
+    main()
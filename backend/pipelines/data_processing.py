@@ -7,6 +7,9 @@ from ml.iqv_predictor import IQVPredictor
 
 logger = logging.getLogger(__name__)
 
+# Caminho absoluto do modelo avulso (IQV_PREDICTOR=file), independente do diretório de trabalho
+LEGACY_MODEL_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "models", "iqv_predictor.pkl")
+
 # Funções de serviço (simuladas para desenvolvimento)
 def get_weather_data(city: str) -> dict:
     """Stub para obter dados climáticos"""
@@ -52,12 +55,25 @@ def save_to_database(city: str, data: dict):
     
     logger.info(f"Dados salvos em {filepath}")
 
+def get_predictor():
+    """Preditor de IQV configurado em IQV_PREDICTOR (registry, online ou file)"""
+    predictor_kind = os.getenv("IQV_PREDICTOR", "registry").lower()
+    if predictor_kind == "online":
+        # Modelo incremental atualizado pelo ETL de clima
+        from ml.online_predictor import get_online_predictor
+        return get_online_predictor()
+    if predictor_kind == "registry":
+        # Versão promovida no registro de modelos, compartilhada e trocada a quente
+        from ml.model_registry import get_registry_predictor
+        return get_registry_predictor()
+    return IQVPredictor(model_path=LEGACY_MODEL_PATH)
+
 class DataPipeline:
     def __init__(self, city: str):
         self.city = city
         self.raw_data = {}
         self.processed_data = {}
-        self.predictor = IQVPredictor(model_path="./models/iqv_predictor.pkl")
+        self.predictor = get_predictor()
         
     def extract(self):
         """Extrai dados de múltiplas fontes (clima, trânsito, qualidade do ar, etc.)"""
@@ -1,58 +1,125 @@
 import pandas as pd
 from datetime import datetime
 from pathlib import Path
+from typing import Iterator, Optional
 import numpy as np
+from pipelines.parquet_history import ParquetHistory
 
 # Diretório de dados
 DATA_DIR = Path(__file__).parent.parent / "data"
-INPUT_FILE = DATA_DIR / "traffic_data.parquet"
+HISTORY_DIR = DATA_DIR / "traffic_history"
+# Histórico sintético do teste de carga, separado do histórico real (lido pela API, previsões e treino)
+SIMULATED_HISTORY_DIR = DATA_DIR / "simulated" / "traffic_history"
 
 # Rotas com nomes descritivos
 ROUTES = [
     {
         "name": "Avenida Paulista → Aeroporto de Congonhas",
+        "city": "São Paulo",
         "base_duration_min": 20  # Duração sem trânsito (em minutos)
     },
     {
         "name": "Av. Faria Lima → Barra da Tijuca",
+        "city": "São Paulo",
         "base_duration_min": 60
     },
     {
         "name": "Praça da Sé → Morumbi",
+        "city": "São Paulo",
         "base_duration_min": 25
     }
 ]
 
-def generate_reliable_traffic_data():
+# Fator de congestionamento por hora do dia (picos às 8h e às 18h)
+HOURLY_CONGESTION = np.array([
+    0.10, 0.08, 0.06, 0.06, 0.08, 0.15, 0.35, 0.70, 0.85, 0.65, 0.45, 0.40,
+    0.45, 0.45, 0.40, 0.45, 0.60, 0.80, 0.90, 0.70, 0.45, 0.30, 0.20, 0.15
+])
+# Multiplicador por dia da semana (segunda = 0 ... domingo = 6)
+WEEKDAY_FACTOR = np.array([1.00, 1.00, 1.00, 1.05, 1.10, 0.55, 0.40])
+# Ruído multiplicativo (log-normal) aplicado a cada rota × instante
+CONGESTION_NOISE_SIGMA = 0.25
+
+SIMULATION_CITIES = ["São Paulo", "Rio de Janeiro", "Belo Horizonte", "Curitiba", "Porto Alegre", "Recife"]
+
+# Histórico append-only particionado por data e cidade, deduplicado por (rota, timestamp)
+traffic_history = ParquetHistory(HISTORY_DIR, key_columns=("route", "timestamp"), partition_columns=("date", "city"))
+
+
+def generate_synthetic_routes(n_routes: int, seed: Optional[int] = None) -> pd.DataFrame:
+    """Gera rotas sintéticas (cidade e duração base) para testes de carga."""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "name": [f"Rota sintética {i:05d}" for i in range(n_routes)],
+        "city": rng.choice(SIMULATION_CITIES, size=n_routes),
+        "base_duration_min": rng.uniform(10, 90, size=n_routes).round(1)
+    })
+
+
+def simulate_route_delays(routes: pd.DataFrame, timestamps: pd.DatetimeIndex,
+                          rng: np.random.Generator) -> pd.DataFrame:
+    """
+    Simula o trânsito de todas as rotas × instantes de uma vez com NumPy.
+    O atraso segue o perfil de hora do dia e dia da semana, escalado pela
+    sensibilidade de cada rota e por um ruído log-normal.
+    """
+    n_routes, n_steps = len(routes), len(timestamps)
+    base_duration_sec = routes["base_duration_min"].to_numpy(dtype=float) * 60
+
+    # Perfil temporal (T,) e sensibilidade por rota (R,)
+    profile = HOURLY_CONGESTION[timestamps.hour] * WEEKDAY_FACTOR[timestamps.dayofweek]
+    sensitivity = rng.uniform(0.6, 1.2, size=n_routes)
+    noise = rng.lognormal(mean=0.0, sigma=CONGESTION_NOISE_SIGMA, size=(n_routes, n_steps))
+    delay_percent = np.clip(sensitivity[:, None] * profile[None, :] * noise, 0.02, 2.0)
+
+    delay_sec = base_duration_sec[:, None] * delay_percent
+    names = routes["name"].to_numpy()
+    return pd.DataFrame({
+        "route": np.repeat(names, n_steps),
+        "origin": np.repeat(names, n_steps),
+        "destination": "Destino",
+        "city": np.repeat(routes["city"].to_numpy(), n_steps),
+        "duration": np.repeat(base_duration_sec, n_steps),
+        "duration_in_traffic": (base_duration_sec[:, None] + delay_sec).ravel(),
+        "delay": delay_sec.ravel(),
+        "timestamp": np.tile(timestamps.to_numpy(), n_routes)
+    })
+
+
+def simulate_traffic_history(routes: pd.DataFrame, start: datetime, periods: int, freq: str = "15min",
+                             seed: Optional[int] = None, chunk_periods: int = 96) -> Iterator[pd.DataFrame]:
+    """
+    Gera o histórico em blocos de `chunk_periods` instantes, para que conjuntos
+    grandes (milhares de rotas × meses) sejam gravados sem ficar todos em memória.
+    """
+    rng = np.random.default_rng(seed)
+    timestamps = pd.date_range(start=start, periods=periods, freq=freq)
+    for offset in range(0, periods, chunk_periods):
+        yield simulate_route_delays(routes, timestamps[offset:offset + chunk_periods], rng)
+
+
+def write_traffic_history(chunks, history: ParquetHistory = traffic_history) -> int:
+    """Acrescenta cada bloco simulado ao histórico de trânsito particionado."""
+    return sum(history.append(chunk) for chunk in chunks)
+
+
+def generate_reliable_traffic_data(seed: Optional[int] = None):
     """Gera dados de trânsito simulados realistas."""
-    traffic_data = []
-    
-    for route in ROUTES:
-        base_duration_sec = route["base_duration_min"] * 60
-        # Simula trânsito (atraso de 10% a 80%)
-        delay_percent = np.random.uniform(0.1, 0.8)
-        delay_sec = base_duration_sec * delay_percent
-        duration_in_traffic_sec = base_duration_sec + delay_sec
-        
-        traffic_data.append({
-            "origin": route["name"],
-            "destination": "Destino",
-            "duration": base_duration_sec,
-            "duration_in_traffic": duration_in_traffic_sec,
-            "delay": delay_sec,
-            "timestamp": datetime.now().isoformat()
-        })
-    
-    return traffic_data
+    now = pd.DatetimeIndex([pd.Timestamp(datetime.now()).floor("min")])
+    df = simulate_route_delays(pd.DataFrame(ROUTES), now, np.random.default_rng(seed))
+    df["timestamp"] = df["timestamp"].dt.strftime("%Y-%m-%dT%H:%M:%S")
+    return df.to_dict(orient="records")
+
 
 def save_traffic_data(data):
-    """Salva dados de trânsito em Parquet."""
+    """Acrescenta dados de trânsito ao histórico Parquet."""
     df = pd.DataFrame(data)
-    df.to_parquet(INPUT_FILE, index=False)
-    print(f"✅ Dados de trânsito salvos em {INPUT_FILE}")
+    written = traffic_history.append(df)
+    print(f"✅ {written} registros de trânsito salvos em {HISTORY_DIR}")
     # Mostra um resumo
     print(df[["origin", "duration", "duration_in_traffic", "delay"]].round(0))
 
+
 def run_traffic_etl():
     """Pipeline completo de ETL para trânsito."""
     try:
@@ -63,6 +130,25 @@ def run_traffic_etl():
         print(f"❌ Erro no ETL de trânsito: {e}")
         return {"status": "error", "message": str(e)}
 
+
+def run_load_test_simulation(n_routes: int = 1000, days: int = 7, freq: str = "15min", seed: int = 42,
+                             output_dir: Path = SIMULATED_HISTORY_DIR):
+    """
+    Gera um histórico sintético de carga (rotas × dias) reprodutível pela semente.
+    Grava em `output_dir` (por padrão data/simulated/), nunca no histórico real.
+    """
+    output_dir = Path(output_dir)
+    if output_dir.resolve() == HISTORY_DIR.resolve():
+        raise ValueError(f"O teste de carga não pode gravar no histórico real ({HISTORY_DIR})")
+    history = ParquetHistory(output_dir, key_columns=traffic_history.key_columns,
+                             partition_columns=traffic_history.partition_columns)
+    routes = generate_synthetic_routes(n_routes, seed=seed)
+    periods = int(pd.Timedelta(days=days) / pd.Timedelta(freq))
+    start = pd.Timestamp(datetime.now()).floor("D") - pd.Timedelta(days=days)
+    written = write_traffic_history(simulate_traffic_history(routes, start, periods, freq=freq, seed=seed), history)
+    return {"status": "success", "routes": n_routes, "rows_written": written, "output_dir": str(output_dir)}
+
+
 if __name__ == "__main__":
     result = run_traffic_etl()
-    print(result)
\ No newline at end of file
+    print(result)
@@ -1,57 +1,115 @@
-from prefect import flow, task
-import requests
+from prefect import flow, task, get_run_logger
+from prefect.task_runners import ConcurrentTaskRunner
 import pandas as pd
 from datetime import datetime
 import os
 import pathlib
+import threading
+from typing import List, Optional
+from pipelines.parquet_history import ParquetHistory
+from services.iqv_service import calculate_iqv, estimate_traffic_delay, normalize_city_name
+from services.iqv_snapshot import get_snapshot_cities
+from services.weather_service import GROUP_MAX_IDS, fetch_current_weather_batch
 
+# Máximo de buscas simultâneas; o limitador de chamadas do weather_service regula a taxa
+ETL_MAX_CONCURRENCY = int(os.getenv("ETL_MAX_CONCURRENCY", 8))
+_fetch_slots = threading.BoundedSemaphore(ETL_MAX_CONCURRENCY)
 
-API_KEY = "060c37193bfdd9af8c1fb0b35f11922d" 
+@task(retries=2, retry_delay_seconds=5)
+def fetch_weather_chunk(cities: List[str]):
+    """Busca um bloco de cidades usando o endpoint /group do OpenWeather"""
+    with _fetch_slots:
+        return list(fetch_current_weather_batch([normalize_city_name(city) for city in cities]).values())
 
-# Diretório de dados relativo ao script
-CURRENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) # D:\city-sense\backend
-DATA_DIR = os.path.join(CURRENT_DIR, "data")
-FILEPATH = os.path.join(DATA_DIR, "weather_data.parquet")
+def collect_successful(chunks: List[List[str]], futures):
+    """Aguarda as tarefas mapeadas; falhas individuais não derrubam o lote"""
+    logger = get_run_logger()
+    results = []
+    for chunk, future in zip(chunks, futures):
+        # Com raise_on_failure=False, uma tarefa que falhou devolve a exceção em vez de levantá-la
+        result = future.result(raise_on_failure=False)
+        if isinstance(result, BaseException):
+            logger.warning(f"Falha ao buscar clima para {', '.join(chunk)}: {result}")
+        else:
+            results.extend(result)
+    return results
 
-@task
-def fetch_weather_data(city="São Paulo"):
-    url = f"http://api.openweathermap.org/data/2.5/weather"
-    params = {
-        "q": city,
-        "appid": API_KEY,
-        "units": "metric",
-        "lang": "pt_br"
-    }
-    response = requests.get(url, params=params)
-    response.raise_for_status() 
-    return response.json()
-
-@task
-def process_weather_data(raw_data):
-    processed = {
+def _process_record(raw_data):
+    return {
         "city": raw_data["name"],
         "temperature": raw_data["main"]["temp"],
         "feels_like": raw_data["main"]["feels_like"],
         "humidity": raw_data["main"]["humidity"],
         "description": raw_data["weather"][0]["description"],
-        "timestamp": datetime.now().isoformat()
+        # Horário da observação no OpenWeather (UTC); junto com a cidade forma a chave de deduplicação
+        "timestamp": datetime.utcfromtimestamp(raw_data["dt"]).isoformat()
     }
-    return processed
+
+@task
+def process_weather_batch(raw_batch):
+    """Processa todas as respostas de uma execução em um único lote"""
+    return [_process_record(raw_data) for raw_data in raw_batch]
 
 DATA_DIR = pathlib.Path(__file__).parent.parent / "data"
+HISTORY_DIR = DATA_DIR / "weather_history"
+
+# Histórico append-only particionado por data e cidade, deduplicado por (cidade, timestamp)
+weather_history = ParquetHistory(HISTORY_DIR, key_columns=("city", "timestamp"), partition_columns=("date", "city"))
+
+@task
+def save_to_parquet(data):
+    df = pd.DataFrame(data if isinstance(data, list) else [data])
+    written = weather_history.append(df)
+    print(f"{written} registros novos salvos em {HISTORY_DIR}")
+    return written
 
 @task
-def save_to_parquet(data, filepath=DATA_DIR / "weather_data.parquet"):
-    os.makedirs(DATA_DIR, exist_ok=True)
-    df = pd.DataFrame([data])
-    df.to_parquet(filepath, index=False)
-    print(f"Dados salvos em {filepath}") 
-
-@flow(name="ETL - Clima São Paulo")
-def etl_weather_flow():
-    raw = fetch_weather_data()
-    processed = process_weather_data(raw)
+def compact_history():
+    return weather_history.compact()
+
+@task
+def update_online_model(data):
+    """Atualiza incrementalmente o modelo online de IQV com as observações da execução"""
+    if os.getenv("IQV_ONLINE_UPDATES", "true").lower() != "true" or not data:
+        return None
+    from ml.online_predictor import get_online_predictor
+    from services.traffic_service import traffic_provider
+    traffic_provider.refresh_if_changed()
+    observations = []
+    for record in data:
+        traffic_delay = estimate_traffic_delay(record)
+        iqv = calculate_iqv(record["temperature"], record["humidity"], traffic_delay)
+        observations.append({
+            "temperature": record["temperature"],
+            "humidity": record["humidity"],
+            "traffic_delay": traffic_delay,
+            "timestamp": record["timestamp"],
+            "iqv_overall": iqv["iqv_overall"]
+        })
+    predictor = get_online_predictor()
+    rmse = predictor.update(observations)
+    # Cada execução do flow pode ser um processo novo: grava a atualização antes de terminar
+    predictor.checkpoint()
+    return rmse
+
+def get_etl_cities() -> List[str]:
+    """Cidades da ingestão: ETL_CITIES (separadas por vírgula) ou a lista do snapshot da API"""
+    configured = os.getenv("ETL_CITIES")
+    if configured:
+        return [city.strip() for city in configured.split(",") if city.strip()]
+    return get_snapshot_cities()
+
+@flow(name="ETL - Clima", task_runner=ConcurrentTaskRunner())
+def etl_weather_flow(cities: Optional[List[str]] = None):
+    cities = cities or get_etl_cities()
+    # Blocos do tamanho aceito pelo /group, buscados concorrentemente pelo task runner
+    chunks = [cities[i:i + GROUP_MAX_IDS] for i in range(0, len(cities), GROUP_MAX_IDS)]
+    raw_batch = collect_successful(chunks, fetch_weather_chunk.map(chunks))
+    processed = process_weather_batch(raw_batch)
+    # Uma única gravação por execução
     save_to_parquet(processed)
+    update_online_model(processed)
+    compact_history()
     return processed
 
 if __name__ == "__main__":
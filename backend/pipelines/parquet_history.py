@@ -0,0 +1,152 @@
+import logging
+import os
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, List, Optional, Sequence
+from urllib.parse import quote
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+ROW_GROUP_SIZE = int(os.getenv("HISTORY_ROW_GROUP_SIZE", 128_000))
+# Número de arquivos em uma partição a partir do qual ela é compactada
+COMPACTION_MIN_FILES = int(os.getenv("HISTORY_COMPACTION_MIN_FILES", 8))
+
+
+class ParquetHistory:
+    """
+    Dataset Parquet append-only particionado no estilo Hive
+    (ex.: `date=2024-01-31/city=Sao%20Paulo/part-*.parquet`).
+
+    Cada execução grava um novo arquivo por partição, descartando linhas cuja
+    chave (ex.: cidade + timestamp) já existe. `compact` une os arquivos pequenos
+    de uma partição em um só. A leitura usa poda de partições e projeção de colunas
+    e deduplica pela chave.
+    """
+
+    def __init__(self, base_dir: Path, key_columns: Sequence[str] = ("city", "timestamp"),
+                 partition_columns: Sequence[str] = ("date", "city"), timestamp_column: str = "timestamp",
+                 row_group_size: int = ROW_GROUP_SIZE):
+        self.base_dir = Path(base_dir)
+        self.key_columns = list(key_columns)
+        self.partition_columns = list(partition_columns)
+        self.timestamp_column = timestamp_column
+        self.row_group_size = row_group_size
+        self._partitioning = ds.partitioning(
+            pa.schema([(column, pa.string()) for column in self.partition_columns]),
+            flavor="hive"
+        )
+
+    def _partition_dir(self, values: Iterable) -> Path:
+        path = self.base_dir
+        for column, value in zip(self.partition_columns, values):
+            path = path / f"{column}={quote(str(value), safe='')}"
+        return path
+
+    def _prepare(self, df: pd.DataFrame) -> pd.DataFrame:
+        df = df.copy()
+        df[self.timestamp_column] = pd.to_datetime(df[self.timestamp_column])
+        if "date" in self.partition_columns:
+            df["date"] = df[self.timestamp_column].dt.strftime("%Y-%m-%d")
+        return df.drop_duplicates(subset=self.key_columns, keep="last")
+
+    def _existing_keys(self, partition_dir: Path) -> pd.DataFrame:
+        files = sorted(partition_dir.glob("*.parquet"))
+        data_keys = [column for column in self.key_columns if column not in self.partition_columns]
+        if not files or not data_keys:
+            return pd.DataFrame(columns=data_keys)
+        return pq.ParquetDataset([str(f) for f in files]).read(columns=data_keys).to_pandas()
+
+    def append(self, df: pd.DataFrame) -> int:
+        """Acrescenta as linhas novas (deduplicadas pela chave) e retorna quantas foram gravadas"""
+        if df.empty:
+            return 0
+        df = self._prepare(df)
+        data_keys = [column for column in self.key_columns if column not in self.partition_columns]
+        written = 0
+        for values, group in df.groupby(self.partition_columns, sort=False):
+            values = values if isinstance(values, tuple) else (values,)
+            partition_dir = self._partition_dir(values)
+            existing = self._existing_keys(partition_dir)
+            if not existing.empty:
+                # Anti-join com as chaves já persistidas na partição
+                merged = group.merge(existing.drop_duplicates(), on=data_keys, how="left", indicator=True)
+                group = merged[merged["_merge"] == "left_only"].drop(columns="_merge")
+            if group.empty:
+                continue
+            partition_dir.mkdir(parents=True, exist_ok=True)
+            table = pa.Table.from_pandas(group.drop(columns=self.partition_columns), preserve_index=False)
+            tmp_path = partition_dir / f".part-{uuid.uuid4().hex}.tmp"
+            pq.write_table(table, tmp_path, row_group_size=self.row_group_size)
+            os.replace(tmp_path, partition_dir / f"part-{datetime.now():%Y%m%d%H%M%S}-{uuid.uuid4().hex[:8]}.parquet")
+            written += len(group)
+        logger.info(f"{written} linhas novas gravadas em {self.base_dir}")
+        return written
+
+    def read(self, columns: Optional[List[str]] = None, cities: Optional[List[str]] = None,
+             start: Optional[datetime] = None, end: Optional[datetime] = None) -> pd.DataFrame:
+        """
+        Lê o histórico filtrando por cidade e intervalo de tempo. Os filtros de
+        cidade e data podam diretórios inteiros antes de qualquer leitura.
+        """
+        if not self.base_dir.exists():
+            return pd.DataFrame(columns=columns or [])
+        dataset = ds.dataset(str(self.base_dir), format="parquet", partitioning=self._partitioning,
+                             exclude_invalid_files=True)
+        expression = None
+
+        def combine(condition):
+            return condition if expression is None else expression & condition
+
+        if cities is not None and "city" in self.partition_columns:
+            expression = combine(ds.field("city").isin(list(cities)))
+        if start is not None:
+            if "date" in self.partition_columns:
+                expression = combine(ds.field("date") >= start.strftime("%Y-%m-%d"))
+            expression = combine(ds.field(self.timestamp_column) >= pa.scalar(pd.Timestamp(start), pa.timestamp("ns")))
+        if end is not None:
+            if "date" in self.partition_columns:
+                expression = combine(ds.field("date") <= end.strftime("%Y-%m-%d"))
+            expression = combine(ds.field(self.timestamp_column) <= pa.scalar(pd.Timestamp(end), pa.timestamp("ns")))
+        # Chaves sempre lidas: uma compactação interrompida (arquivo compactado já
+        # gravado, partes antigas ainda presentes) não duplica linhas na leitura
+        read_columns = None if columns is None else list(dict.fromkeys([*columns, *self.key_columns]))
+        df = dataset.to_table(columns=read_columns, filter=expression).to_pandas()
+        df = df.drop_duplicates(subset=self.key_columns, keep="last")
+        return (df if columns is None else df[columns]).reset_index(drop=True)
+
+    def compact(self, min_files: int = COMPACTION_MIN_FILES) -> int:
+        """
+        Une os arquivos de cada partição com pelo menos `min_files` arquivos em um
+        único arquivo ordenado por tempo e deduplicado. Retorna o número de partições compactadas.
+        """
+        if not self.base_dir.exists():
+            return 0
+        depth = "/".join("*" for _ in self.partition_columns)
+        compacted = 0
+        for partition_dir in sorted(self.base_dir.glob(depth)):
+            files = sorted(partition_dir.glob("*.parquet"))
+            if len(files) < min_files:
+                continue
+            # Sem inferir partições do caminho: date/city não são gravados dentro do arquivo
+            df = pq.ParquetDataset([str(f) for f in files], partitioning=None).read().to_pandas()
+            data_keys = [column for column in self.key_columns if column not in self.partition_columns]
+            df = df.drop_duplicates(subset=data_keys, keep="last").sort_values(self.timestamp_column)
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            tmp_path = partition_dir / f".compact-{uuid.uuid4().hex}.tmp"
+            pq.write_table(table, tmp_path, row_group_size=self.row_group_size)
+            os.replace(tmp_path, partition_dir / f"part-compacted-{datetime.now():%Y%m%d%H%M%S}-{uuid.uuid4().hex[:8]}.parquet")
+            # Até aqui a partição só ganhou um arquivo com linhas repetidas, que
+            # `read` e `append` deduplicam pela chave; remover as partes antigas
+            # depois é seguro mesmo se o processo cair no meio
+            for f in files:
+                f.unlink(missing_ok=True)
+            compacted += 1
+        if compacted:
+            logger.info(f"{compacted} partições compactadas em {self.base_dir}")
+        return compacted
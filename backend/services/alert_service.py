@@ -1,39 +1,275 @@
+import json
+import logging
+import os
+import re
+import string
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+from services.iqv_service import city_key
+
+logger = logging.getLogger(__name__)
+
+ALERT_COOLDOWN_SECONDS = int(os.getenv("ALERT_COOLDOWN_SECONDS", 3600))
+
+# Tabela declarativa de regras; pode ser substituída por um JSON em ALERT_RULES_FILE
+DEFAULT_ALERT_RULES = [
+    {
+        "type": "heat",
+        "field": "temperature",
+        "operator": ">",
+        "threshold": 35,
+        "severity": "high",
+        "message": "⚠️ Calor extremo! {temperature}°C - Recomenda-se evitar exposição ao sol"
+    },
+    {
+        "type": "cold",
+        "field": "temperature",
+        "operator": "<",
+        "threshold": 5,
+        "severity": "high",
+        "message": "❄️ Frio extremo! {temperature}°C - Agasalhe-se bem ao sair"
+    },
+    {
+        "type": "humidity",
+        "field": "humidity",
+        "operator": ">",
+        "threshold": 85,
+        "severity": "medium",
+        "message": "💧 Alta umidade ({humidity}%) - Cuidado com mofo e ácaros"
+    },
+    {
+        "type": "traffic",
+        "field": "avg_traffic_delay_min",
+        "operator": ">",
+        "threshold": 20,
+        "default": 0,
+        "severity": "medium",
+        "message": "🚦 Trânsito intenso: {avg_traffic_delay_min} minutos de atraso esperados"
+    },
+    {
+        "type": "air_quality",
+        "field": "aqi",
+        "operator": ">=",
+        "threshold": 4,
+        "severity": "high",
+        "message": "😷 Qualidade do ar ruim (AQI {aqi}) - Evite atividades físicas ao ar livre"
+    }
+]
+
+OPERATORS = {
+    ">": np.greater,
+    ">=": np.greater_equal,
+    "<": np.less,
+    "<=": np.less_equal,
+    "==": np.equal,
+    "!=": np.not_equal
+}
+REQUIRED_RULE_KEYS = ("type", "field", "operator", "threshold", "severity", "message")
+
+
+def message_fields(template: str) -> Set[str]:
+    """Colunas referenciadas pela mensagem da regra ({city}, {temperature}, ...)"""
+    fields = set()
+    for _, name, _, _ in string.Formatter().parse(template):
+        if name is None:
+            continue
+        root = re.split(r"[.\[]", name, maxsplit=1)[0]
+        if not root or root.isdigit():
+            raise ValueError(f"Mensagem de alerta com campo posicional: {template!r}")
+        fields.add(root)
+    return fields
+
+
+class _RowValues(dict):
+    """Valores da linha para a mensagem; colunas ausentes no lote viram texto vazio"""
+
+    def __missing__(self, key):
+        return ""
+
+
+def load_alert_rules(path: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Carrega a tabela de regras de um arquivo JSON (lista de objetos com
+    type, field, operator, threshold, severity, message e default opcional).
+    Sem arquivo configurado, usa as regras padrão.
+    """
+    path = path or os.getenv("ALERT_RULES_FILE")
+    if not path:
+        return [dict(rule) for rule in DEFAULT_ALERT_RULES]
+    with open(path, encoding="utf-8") as f:
+        rules = json.load(f)
+    for rule in rules:
+        missing = [key for key in REQUIRED_RULE_KEYS if key not in rule]
+        if missing:
+            raise ValueError(f"Regra de alerta inválida {rule}: faltando {', '.join(missing)}")
+        if rule["operator"] not in OPERATORS:
+            raise ValueError(f"Operador de alerta desconhecido: {rule['operator']}")
+        # Template malformado é rejeitado aqui, e não na avaliação de cada lote
+        try:
+            message_fields(rule["message"])
+        except ValueError as e:
+            raise ValueError(f"Mensagem inválida na regra de alerta {rule['type']}: {e}")
+    logger.info(f"{len(rules)} regras de alerta carregadas de {path}")
+    return rules
+
+
+class AlertEngine:
+    """
+    Avalia a tabela de regras sobre um DataFrame inteiro de cidades: cada regra
+    vira uma única comparação vetorizada sobre a coluna correspondente.
+    """
+
+    def __init__(self, rules: Optional[List[Dict[str, Any]]] = None):
+        self.rules = rules if rules is not None else load_alert_rules()
+        self._compiled = [
+            (rule, OPERATORS[rule["operator"]], float(rule["threshold"]), rule.get("default", np.nan),
+             message_fields(rule["message"]) | {rule["field"]})
+            for rule in self.rules
+        ]
+        # Campos de comparação e das mensagens: uma mudança em qualquer um reavalia a cidade
+        self.fields = sorted(set().union(*(fields for *_, fields in self._compiled)))
+
+    def evaluate(self, df: pd.DataFrame) -> List[List[Dict[str, Any]]]:
+        """Retorna, para cada linha do DataFrame (na mesma ordem), a lista de alertas disparados"""
+        alerts: List[List[Dict[str, Any]]] = [[] for _ in range(len(df))]
+        if df.empty:
+            return alerts
+        for rule, compare, threshold, default, fields in self._compiled:
+            if rule["field"] in df.columns:
+                values = pd.to_numeric(df[rule["field"]], errors="coerce").fillna(default).to_numpy(dtype=float)
+            else:
+                values = np.full(len(df), default, dtype=float)
+            # Comparações com NaN são falsas: campos ausentes nunca disparam alerta
+            for position in np.flatnonzero(compare(values, threshold)):
+                row = _RowValues({field: df[field].iat[position] for field in fields if field in df.columns})
+                row.setdefault(rule["field"], rule.get("default"))
+                alerts[position].append({
+                    "type": rule["type"],
+                    "severity": rule["severity"],
+                    "message": rule["message"].format_map(row)
+                })
+        return alerts
+
+
+class AlertDeduplicator:
+    """
+    Suprime alertas repetidos: cada par (cidade, tipo) é emitido no máximo uma
+    vez por janela de cooldown, e é rearmado assim que a condição deixa de ocorrer.
+    """
+
+    def __init__(self, cooldown_seconds: int = ALERT_COOLDOWN_SECONDS):
+        self.cooldown_seconds = cooldown_seconds
+        self._lock = threading.Lock()
+        self._last_emitted: Dict[str, Dict[str, float]] = {}
+
+    def filter(self, city: str, alerts: List[Dict[str, Any]], now: Optional[float] = None) -> List[Dict[str, Any]]:
+        now = time.time() if now is None else now
+        emitted = []
+        with self._lock:
+            previous = self._last_emitted.get(city, {})
+            # Tipos que não estão mais ativos são descartados (rearmados)
+            current = {}
+            for alert in alerts:
+                last = previous.get(alert["type"])
+                if last is None or now - last >= self.cooldown_seconds:
+                    current[alert["type"]] = now
+                    emitted.append(alert)
+                else:
+                    current[alert["type"]] = last
+            if current:
+                self._last_emitted[city] = current
+            else:
+                self._last_emitted.pop(city, None)
+        return emitted
+
+
+class AlertStore:
+    """
+    Alertas ativos por cidade, com índices por tipo e severidade. Cada cidade só
+    é reavaliada quando algum campo usado pelas regras muda desde a última avaliação.
+    """
+
+    def __init__(self, engine: Optional[AlertEngine] = None):
+        self.engine = engine or default_engine
+        self._lock = threading.Lock()
+        self._fingerprints: Dict[str, tuple] = {}
+        self._by_city: Dict[str, Dict[str, Any]] = {}
+        self._by_type: Dict[str, Set[str]] = {}
+        self._by_severity: Dict[str, Set[str]] = {}
+
+    def _fingerprint(self, row: Dict[str, Any]) -> tuple:
+        return tuple(row.get(field) for field in self.engine.fields)
+
+    def refresh(self, rows: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], List[Dict[str, Any]]]]:
+        """
+        Avalia, em uma única passada vetorizada, apenas as cidades cujas entradas
+        mudaram. Retorna os pares (linha, alertas) efetivamente reavaliados.
+        """
+        with self._lock:
+            changed = [
+                row for row in rows
+                if self._fingerprints.get(city_key(row["city"])) != self._fingerprint(row)
+            ]
+        if not changed:
+            return []
+        results = list(zip(changed, self.engine.evaluate(pd.DataFrame(changed))))
+        evaluated_at = time.time()
+        with self._lock:
+            for row, alerts in results:
+                key = city_key(row["city"])
+                self._unindex(key)
+                self._fingerprints[key] = self._fingerprint(row)
+                self._by_city[key] = {"city": row["city"], "alerts": alerts, "evaluated_at": evaluated_at}
+                for alert in alerts:
+                    self._by_type.setdefault(alert["type"], set()).add(key)
+                    self._by_severity.setdefault(alert["severity"], set()).add(key)
+        return results
+
+    def _unindex(self, key: str) -> None:
+        previous = self._by_city.get(key)
+        if previous is None:
+            return
+        for alert in previous["alerts"]:
+            self._by_type.get(alert["type"], set()).discard(key)
+            self._by_severity.get(alert["severity"], set()).discard(key)
+
+    def get_city(self, city: str) -> Optional[Dict[str, Any]]:
+        """Alertas ativos de uma cidade (None se ela nunca foi avaliada)"""
+        with self._lock:
+            entry = self._by_city.get(city_key(city))
+            return {**entry, "alerts": list(entry["alerts"])} if entry is not None else None
+
+    def query(self, alert_type: Optional[str] = None, severity: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Todos os alertas ativos, opcionalmente filtrados por tipo e/ou severidade"""
+        with self._lock:
+            keys = set(self._by_city)
+            if alert_type is not None:
+                keys &= self._by_type.get(alert_type, set())
+            if severity is not None:
+                keys &= self._by_severity.get(severity, set())
+            results = []
+            for key in sorted(keys):
+                entry = self._by_city[key]
+                for alert in entry["alerts"]:
+                    if alert_type is not None and alert["type"] != alert_type:
+                        continue
+                    if severity is not None and alert["severity"] != severity:
+                        continue
+                    results.append({"city": entry["city"], **alert, "evaluated_at": entry["evaluated_at"]})
+            return results
+
+
+default_engine = AlertEngine()
+alert_store = AlertStore()
+
+
 def check_weather_alerts(weather_data: dict) -> list:
     """
     Verifica se há condições climáticas que merecem alerta
     """
-    alerts = []
-    
-    # Alerta para calor extremo
-    if weather_data["temperature"] > 35:
-        alerts.append({
-            "type": "heat",
-            "severity": "high",
-            "message": f"⚠️ Calor extremo! {weather_data['temperature']}°C - Recomenda-se evitar exposição ao sol"
-        })
-    
-    # Alerta para frio extremo
-    if weather_data["temperature"] < 5:
-        alerts.append({
-            "type": "cold",
-            "severity": "high",
-            "message": f"❄️ Frio extremo! {weather_data['temperature']}°C - Agasalhe-se bem ao sair"
-        })
-    
-    # Alerta para alta umidade
-    if weather_data["humidity"] > 85:
-        alerts.append({
-            "type": "humidity",
-            "severity": "medium",
-            "message": f"💧 Alta umidade ({weather_data['humidity']}%) - Cuidado com mofo e ácaros"
-        })
-    
-    # Alerta para condições de trânsito
-    if weather_data.get("avg_traffic_delay_min", 0) > 20:
-        alerts.append({
-            "type": "traffic",
-            "severity": "medium",
-            "message": f"🚦 Trânsito intenso: {weather_data['avg_traffic_delay_min']} minutos de atraso esperados"
-        })
-    
-    return alerts
\ No newline at end of file
+    return default_engine.evaluate(pd.DataFrame([weather_data]))[0]
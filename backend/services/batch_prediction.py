@@ -0,0 +1,157 @@
+import io
+import json
+import os
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+# Limite de linhas por requisição (linhas explícitas ou produto da grade)
+MAX_BATCH_ROWS = int(os.getenv("MAX_BATCH_ROWS", 1_000_000))
+REQUIRED_COLUMNS = ("temperature", "humidity", "traffic_delay")
+OPTIONAL_COLUMNS = ("day_of_week", "month")
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+
+class InvalidBatchError(ValueError):
+    """Corpo da requisição em lote inválido (HTTP 400)"""
+
+
+def _as_column(name: str, values: Any) -> np.ndarray:
+    try:
+        column = np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        raise ValueError(f"Coluna '{name}' deve conter apenas números")
+    if column.ndim != 1:
+        raise ValueError(f"Coluna '{name}' deve ser uma lista de números")
+    return column
+
+
+def _check_size(n_rows: int) -> None:
+    if n_rows == 0:
+        raise ValueError("Nenhuma linha para prever")
+    if n_rows > MAX_BATCH_ROWS:
+        raise ValueError(f"Lote de {n_rows} linhas excede o limite de {MAX_BATCH_ROWS}")
+
+
+def _validate(columns: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    missing = [name for name in REQUIRED_COLUMNS if name not in columns]
+    if missing:
+        raise ValueError(f"Colunas obrigatórias ausentes: {', '.join(missing)}")
+    unknown = set(columns) - set(REQUIRED_COLUMNS) - set(OPTIONAL_COLUMNS)
+    if unknown:
+        raise ValueError(f"Colunas desconhecidas: {', '.join(sorted(unknown))}")
+    lengths = {len(column) for column in columns.values()}
+    if len(lengths) != 1:
+        raise ValueError("Todas as colunas devem ter o mesmo número de linhas")
+    _check_size(lengths.pop())
+    if "day_of_week" in columns and not np.isin(columns["day_of_week"], np.arange(7)).all():
+        raise ValueError("day_of_week deve estar entre 0 (segunda) e 6 (domingo)")
+    if "month" in columns and not np.isin(columns["month"], np.arange(1, 13)).all():
+        raise ValueError("month deve estar entre 1 e 12")
+    return columns
+
+
+def parse_json_payload(payload: Any) -> Dict[str, np.ndarray]:
+    """
+    Converte o corpo JSON em colunas NumPy. Formatos aceitos:
+      {"columns": {"temperature": [...], "humidity": [...], "traffic_delay": [...]}}
+      {"fields": ["temperature", "humidity", "traffic_delay"], "rows": [[25, 60, 10], ...]}
+      {"grid": {"temperature": [...], "humidity": [...], "traffic_delay": [...]}}  (produto cartesiano)
+    `day_of_week` e `month` são opcionais; sem eles, usa a data atual.
+    """
+    if not isinstance(payload, dict):
+        raise ValueError("Corpo deve ser um objeto JSON")
+    if "columns" in payload:
+        if not isinstance(payload["columns"], dict):
+            raise ValueError("'columns' deve mapear nome da coluna para lista de valores")
+        return _validate({name: _as_column(name, values) for name, values in payload["columns"].items()})
+    if "rows" in payload:
+        fields = payload.get("fields", list(REQUIRED_COLUMNS))
+        try:
+            rows = np.asarray(payload["rows"], dtype=np.float64)
+        except (TypeError, ValueError):
+            raise ValueError(f"Cada linha deve ter {len(fields)} valores numéricos ({', '.join(fields)})")
+        if rows.size == 0:
+            rows = rows.reshape(0, len(fields))
+        if rows.ndim != 2 or rows.shape[1] != len(fields):
+            raise ValueError(f"Cada linha deve ter {len(fields)} valores ({', '.join(fields)})")
+        return _validate({name: rows[:, i] for i, name in enumerate(fields)})
+    if "grid" in payload:
+        grid = payload["grid"]
+        if not isinstance(grid, dict):
+            raise ValueError("'grid' deve mapear nome da coluna para lista de valores")
+        axes = {name: _as_column(name, values) for name, values in grid.items()}
+        _check_size(int(np.prod([len(axis) for axis in axes.values()], dtype=np.int64)))
+        mesh = np.meshgrid(*axes.values(), indexing="ij")
+        return _validate({name: values.ravel() for name, values in zip(axes, mesh)})
+    raise ValueError("Informe 'columns', 'rows' ou 'grid'")
+
+
+def parse_arrow_payload(body: bytes) -> Dict[str, np.ndarray]:
+    """Lê um stream Arrow IPC com uma coluna por feature"""
+    import pyarrow as pa
+    try:
+        table = pa.ipc.open_stream(body).read_all()
+    except pa.ArrowInvalid as e:
+        raise ValueError(f"Stream Arrow inválido: {e}")
+    return _validate({name: _as_column(name, table.column(name).to_numpy()) for name in table.column_names})
+
+
+def predict_columns(model, columns: Dict[str, np.ndarray], now: Optional[datetime] = None) -> np.ndarray:
+    """Monta a matriz de features e avalia o lote inteiro em uma única chamada ao modelo"""
+    from ml.iqv_predictor import build_features
+    now = now or datetime.now()
+    n_rows = len(columns["temperature"])
+    features = {
+        "temperature": columns["temperature"],
+        "humidity": columns["humidity"],
+        "traffic_delay": columns["traffic_delay"],
+        "day_of_week": columns["day_of_week"].astype(np.int64) if "day_of_week" in columns
+        else np.full(n_rows, now.weekday()),
+        "month": columns["month"].astype(np.int64) if "month" in columns else np.full(n_rows, now.month),
+    }
+    return np.asarray(model.predict(build_features(features)), dtype=np.float64)
+
+
+def encode_json(columns: Dict[str, np.ndarray], predictions: np.ndarray, model_version: Optional[str]) -> bytes:
+    """Resposta colunar: uma lista por coluna, sem um objeto por linha"""
+    body = {
+        "rows": int(len(predictions)),
+        "model_version": model_version,
+        "columns": {name: values.tolist() for name, values in columns.items()},
+    }
+    body["columns"]["predicted_iqv"] = np.round(predictions, 4).tolist()
+    return json.dumps(body).encode("utf-8")
+
+
+def encode_arrow(columns: Dict[str, np.ndarray], predictions: np.ndarray, model_version: Optional[str]) -> bytes:
+    """Resposta em stream Arrow IPC (versão do modelo nos metadados do schema)"""
+    import pyarrow as pa
+    table = pa.table({**columns, "predicted_iqv": predictions})
+    table = table.replace_schema_metadata({"model_version": model_version or ""})
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+def run_batch(model, model_version: Optional[str], body: bytes, content_type: str,
+              wants_arrow: bool) -> Tuple[bytes, str]:
+    """
+    Decodifica, valida, prevê e serializa o lote; roda inteiro fora do event loop.
+    Retorna (conteúdo, media type). Erros no corpo viram InvalidBatchError.
+    """
+    try:
+        if content_type.startswith(ARROW_MEDIA_TYPE):
+            columns = parse_arrow_payload(body)
+        else:
+            # json.JSONDecodeError também é ValueError
+            columns = parse_json_payload(json.loads(body or b"null"))
+    except ValueError as e:
+        raise InvalidBatchError(str(e)) from e
+    predictions = predict_columns(model, columns)
+    if wants_arrow:
+        return encode_arrow(columns, predictions, model_version), ARROW_MEDIA_TYPE
+    # Serialização direta: evita o jsonable_encoder do FastAPI em listas grandes
+    return encode_json(columns, predictions, model_version), "application/json"
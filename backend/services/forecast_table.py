@@ -0,0 +1,113 @@
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from services.iqv_service import city_key
+
+logger = logging.getLogger(__name__)
+
+FORECAST_TABLE_FILE = Path(os.getenv(
+    "FORECAST_TABLE_FILE", Path(__file__).parent.parent / "data" / "forecast.arrow"
+))
+
+
+class _TableState(NamedTuple):
+    signature: Tuple[int, int, int]
+    table: pa.Table
+    ranges: Dict[str, Tuple[int, int]]
+    ds: np.ndarray
+
+
+class ForecastTable:
+    """
+    Previsões por cidade servidas a partir do arquivo Arrow IPC gerado por
+    `export_forecast_table`, aberto por memory-map. O arquivo vem ordenado por
+    cidade e data, então cada cidade é uma faixa contígua de linhas: a consulta
+    é um acesso ao índice cidade → (início, fim) e uma busca binária nas datas.
+    Quando o arquivo é substituído, o novo estado é montado e trocado de uma vez;
+    leitores em andamento continuam com o estado anterior.
+    """
+
+    def __init__(self, path: Path = FORECAST_TABLE_FILE):
+        self.path = Path(path)
+        self._state: Optional[_TableState] = None
+        self._reload_lock = threading.Lock()
+
+    def _signature(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def _load(self, signature: Tuple[int, int, int]) -> _TableState:
+        table = pa.ipc.open_file(pa.memory_map(str(self.path), "r")).read_all()
+        cities = table.column("city").to_numpy(zero_copy_only=False)
+        boundaries = np.flatnonzero(cities[1:] != cities[:-1]) + 1
+        starts = np.concatenate(([0], boundaries))
+        stops = np.concatenate((boundaries, [len(cities)]))
+        ranges = {city_key(cities[start]): (int(start), int(stop)) for start, stop in zip(starts, stops) if stop > start}
+        ds = table.column("ds").to_numpy().astype("datetime64[ns]")
+        logger.info(f"Tabela de previsões carregada: {table.num_rows} linhas, {len(ranges)} cidades")
+        return _TableState(signature, table, ranges, ds)
+
+    def current(self) -> Optional[_TableState]:
+        """Estado atual, recarregado se o arquivo mudou desde a última leitura"""
+        signature = self._signature()
+        state = self._state
+        if signature is None:
+            return state
+        if state is None or state.signature != signature:
+            with self._reload_lock:
+                state = self._state
+                if state is None or state.signature != signature:
+                    state = self._load(signature)
+                    self._state = state
+        return state
+
+    def version(self) -> Optional[str]:
+        state = self.current()
+        return None if state is None else "-".join(str(part) for part in state.signature)
+
+    def get_city(self, city: str, start: Optional[pd.Timestamp] = None,
+                 end: Optional[pd.Timestamp] = None) -> Optional[Dict[str, Any]]:
+        """Previsão (yhat e limites) da cidade no intervalo [start, end), ou None se não houver"""
+        state = self.current()
+        if state is None:
+            return None
+        bounds = state.ranges.get(city_key(city))
+        if bounds is None:
+            return None
+        first, last = bounds
+        ds = state.ds[first:last]
+        if start is not None:
+            first += int(np.searchsorted(ds, pd.Timestamp(start).to_datetime64(), side="left"))
+        if end is not None:
+            last = bounds[0] + int(np.searchsorted(ds, pd.Timestamp(end).to_datetime64(), side="left"))
+        rows = state.table.slice(first, max(0, last - first))
+        columns = {name: rows.column(name).to_pylist() for name in ("ds", "yhat", "yhat_lower", "yhat_upper")}
+        generated_at = state.table.column("generated_at")[bounds[0]].as_py()
+        return {
+            "city": state.table.column("city")[bounds[0]].as_py(),
+            "generated_at": generated_at.isoformat() if generated_at else None,
+            "forecast": [
+                {
+                    "date": ds_value.isoformat(),
+                    "yhat": round(yhat, 2),
+                    "yhat_lower": round(lower, 2),
+                    "yhat_upper": round(upper, 2)
+                }
+                for ds_value, yhat, lower, upper in zip(
+                    columns["ds"], columns["yhat"], columns["yhat_lower"], columns["yhat_upper"]
+                )
+            ]
+        }
+
+
+forecast_table = ForecastTable()
@@ -0,0 +1,119 @@
+import asyncio
+import math
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+# Tamanho da célula em graus (0.05° ≈ 5,5 km de latitude)
+GEO_CACHE_CELL_DEG = float(os.getenv("GEO_CACHE_CELL_DEG", 0.05))
+# Validade das respostas de ar e ruído por célula (mesmo padrão de WEATHER_CACHE_TTL_SECONDS)
+GEO_CACHE_TTL_SECONDS = int(os.getenv("GEO_CACHE_TTL_SECONDS", 1800))
+GEO_CACHE_NEIGHBOR_FALLBACK = os.getenv("GEO_CACHE_NEIGHBOR_FALLBACK", "true").lower() == "true"
+GEO_CACHE_MAX_ENTRIES = int(os.getenv("GEO_CACHE_MAX_ENTRIES", 50000))
+
+Cell = Tuple[int, int]
+
+
+class GridCache:
+    """
+    Cache para consultas por coordenada quantizadas em uma grade regular.
+    Todas as coordenadas de uma célula compartilham a mesma entrada; a consulta
+    upstream é feita no centro da célula e chamadas simultâneas para a mesma
+    célula são coalescidas em uma só. Em caso de falta, uma célula vizinha
+    ainda válida pode ser usada como aproximação.
+    """
+
+    def __init__(self, cell_size: float = GEO_CACHE_CELL_DEG, ttl_seconds: int = GEO_CACHE_TTL_SECONDS,
+                 neighbor_fallback: bool = GEO_CACHE_NEIGHBOR_FALLBACK, max_entries: int = GEO_CACHE_MAX_ENTRIES):
+        self.cell_size = cell_size
+        self.ttl_seconds = ttl_seconds
+        self.neighbor_fallback = neighbor_fallback
+        self.max_entries = max_entries
+        self._entries: Dict[Tuple[str, Cell], Tuple[float, Any]] = {}
+        self._in_flight: Dict[Tuple[str, Cell], asyncio.Future] = {}
+        self.hits = 0
+        self.neighbor_hits = 0
+        self.misses = 0
+
+    def cell(self, lat: float, lon: float) -> Cell:
+        return int(math.floor(lat / self.cell_size)), int(math.floor(lon / self.cell_size))
+
+    def cell_center(self, cell: Cell) -> Tuple[float, float]:
+        i, j = cell
+        return round((i + 0.5) * self.cell_size, 6), round((j + 0.5) * self.cell_size, 6)
+
+    def _fresh(self, key: Tuple[str, Cell], now: float) -> Optional[Tuple[float, Any]]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= now:
+            return None
+        return entry
+
+    def get(self, kind: str, lat: float, lon: float) -> Tuple[bool, Any]:
+        """Retorna (encontrado, valor) para a célula da coordenada ou, opcionalmente, uma vizinha"""
+        now = time.time()
+        cell = self.cell(lat, lon)
+        entry = self._fresh((kind, cell), now)
+        if entry is not None:
+            self.hits += 1
+            return True, entry[1]
+        if self.neighbor_fallback:
+            i, j = cell
+            neighbors = [(i + di, j + dj) for di in (-1, 0, 1) for dj in (-1, 0, 1) if di or dj]
+            # Vizinhas mais próximas do ponto consultado primeiro
+            neighbors.sort(key=lambda c: (self.cell_center(c)[0] - lat) ** 2 + (self.cell_center(c)[1] - lon) ** 2)
+            for neighbor in neighbors:
+                entry = self._fresh((kind, neighbor), now)
+                if entry is not None:
+                    self.neighbor_hits += 1
+                    return True, entry[1]
+        self.misses += 1
+        return False, None
+
+    def set(self, kind: str, lat: float, lon: float, value: Any) -> None:
+        if len(self._entries) >= self.max_entries:
+            self.purge_expired()
+            if len(self._entries) >= self.max_entries:
+                # Remove a entrada mais próxima de expirar
+                del self._entries[min(self._entries, key=lambda key: self._entries[key][0])]
+        self._entries[(kind, self.cell(lat, lon))] = (time.time() + self.ttl_seconds, value)
+
+    def purge_expired(self) -> None:
+        now = time.time()
+        for key in [key for key, (expires_at, _) in self._entries.items() if expires_at <= now]:
+            del self._entries[key]
+
+    async def get_or_fetch(self, kind: str, lat: float, lon: float,
+                           fetch: Callable[[float, float], Awaitable[Any]]) -> Any:
+        """
+        Retorna o valor em cache da célula ou chama `fetch` uma única vez, no
+        centro da célula, mesmo com várias requisições simultâneas. Exceções de
+        `fetch` são repassadas a todos os que aguardam e não ficam em cache.
+        """
+        found, value = self.get(kind, lat, lon)
+        if found:
+            return value
+        key = (kind, self.cell(lat, lon))
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            return await asyncio.shield(in_flight)
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            center_lat, center_lon = self.cell_center(key[1])
+            value = await fetch(center_lat, center_lon)
+            self.set(kind, lat, lon, value)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Evita o aviso de exceção não recuperada quando não há outros aguardando
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[key]
+
+
+geo_cache = GridCache()
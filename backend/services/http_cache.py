@@ -0,0 +1,69 @@
+import hashlib
+import time
+from typing import Any, Optional
+
+from fastapi import Request, Response
+
+# O OpenWeather atualiza as condições atuais aproximadamente a cada 10 minutos
+WEATHER_FRESHNESS_SECONDS = 600
+# A previsão de 5 dias / 3 horas é recalculada a cada 3 horas
+FORECAST_FRESHNESS_SECONDS = 3 * 60 * 60
+
+
+def make_etag(*parts: Any) -> str:
+    """
+    Gera um ETag forte a partir dos identificadores de versão dos dados upstream
+    (ex.: cidade + campo `dt`/`updated_at` do OpenWeather).
+    """
+    raw = "|".join(str(part) for part in parts)
+    digest = hashlib.sha1(raw.encode("utf-8")).hexdigest()
+    return f'"{digest}"'
+
+
+def remaining_freshness(updated_at: Optional[int], freshness_seconds: int, now: Optional[float] = None) -> int:
+    """
+    Calcula quantos segundos ainda restam até o dado upstream ser substituído.
+    Sem `updated_at`, assume o ciclo fixo de atualização (alinhado ao relógio).
+    """
+    now = time.time() if now is None else now
+    if updated_at is None:
+        return int(freshness_seconds - (now % freshness_seconds))
+    return max(0, int(updated_at + freshness_seconds - now))
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Compara o cabeçalho If-None-Match com o ETag (comparação fraca, RFC 7232)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    target = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == target:
+            return True
+    return False
+
+
+def cache_headers(etag: str, max_age: int) -> dict:
+    """Monta os cabeçalhos de cache compartilhados entre navegador e CDN"""
+    if max_age > 0:
+        cache_control = f"public, max-age={max_age}"
+    else:
+        cache_control = "public, max-age=0, must-revalidate"
+    return {"ETag": etag, "Cache-Control": cache_control}
+
+
+def conditional_response(request: Request, response: Response, etag: str, max_age: int) -> Optional[Response]:
+    """
+    Aplica ETag/Cache-Control à resposta. Se o cliente já possui a versão atual
+    (If-None-Match), retorna uma resposta 304 sem corpo para ser devolvida
+    diretamente pelo endpoint; caso contrário retorna None.
+    """
+    headers = cache_headers(etag, max_age)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
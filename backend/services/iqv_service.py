@@ -0,0 +1,117 @@
+import unicodedata
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+
+def normalize_city_name(city: str) -> str:
+    """
+    Remove acentos e normaliza o nome da cidade para compatibilidade com APIs externas.
+    Ex: 'São Paulo' -> 'Sao Paulo'
+    """
+    # Normaliza para forma NFD e remove os diacríticos
+    normalized = unicodedata.normalize('NFD', city)
+    ascii_city = ''.join(c for c in normalized if unicodedata.category(c) != 'Mn')
+    return ascii_city.strip()
+
+
+def city_key(city: str) -> str:
+    """
+    Chave de busca independente de acentos e maiúsculas. Única definição usada
+    por snapshot, índices, alertas, trânsito e previsões: as chaves precisam coincidir.
+    """
+    return normalize_city_name(city).casefold()
+
+
+def calculate_iqv(temperature: float, humidity: float, traffic_delay: float = 0,
+                  aqi: Optional[int] = None, noise_db: Optional[float] = None) -> Dict[str, float]:
+    """
+    Calcula o Índice de Qualidade de Vida (IQV) com base nos dados climáticos e de trânsito.
+    Quando informados, qualidade do ar (AQI 1-5 do OpenWeather) e ruído (dB) entram
+    como componentes adicionais e os pesos são renormalizados.
+    """
+    # Cálculo do IQV Clima (baseado em temperatura)
+    temp_score = max(0, min(10, 10 - abs(temperature - 22.5) / 2.5))
+    # Cálculo do IQV Umidade (ideal: 40-60%)
+    humidity_score = max(0, min(10, 10 - abs(humidity - 50) / 5))
+    # Cálculo do IQV Trânsito (ideal: 0 minutos de atraso)
+    traffic_score = max(0, min(10, 10 - traffic_delay / 3))
+    # Cálculo do IQV Tendência
+    trend_score = 5 + (22.5 - temperature) / 5
+    # Cálculo do IQV Geral (média ponderada)
+    weighted_sum = (
+        temp_score * 0.3 +
+        humidity_score * 0.2 +
+        traffic_score * 0.3 +
+        trend_score * 0.2
+    )
+    total_weight = 1.0
+    result = {
+        "iqv_climate": round(temp_score, 2),
+        "iqv_humidity": round(humidity_score, 2),
+        "iqv_traffic": round(traffic_score, 2),
+        "iqv_trend": round(trend_score, 2)
+    }
+    if aqi is not None:
+        # Cálculo do IQV Ar (AQI 1 = bom ... 5 = muito ruim)
+        air_score = max(0, min(10, 10 - (aqi - 1) * 2.5))
+        weighted_sum += air_score * 0.2
+        total_weight += 0.2
+        result["iqv_air"] = round(air_score, 2)
+    if noise_db is not None:
+        # Cálculo do IQV Ruído (ideal: até 40 dB; 80 dB ou mais = 0)
+        noise_score = max(0, min(10, 10 - (noise_db - 40) / 4))
+        weighted_sum += noise_score * 0.1
+        total_weight += 0.1
+        result["iqv_noise"] = round(noise_score, 2)
+    result["iqv_overall"] = round(weighted_sum / total_weight, 2)
+    return result
+
+
+# Atraso padrão (minutos) para cidades sem histórico de trânsito
+LARGE_CITIES = {"sao paulo", "rio de janeiro", "new york", "london", "tokyo"}
+
+
+def estimate_traffic_delay(weather_data: Dict[str, Any]) -> float:
+    """
+    Atraso médio de trânsito (minutos) para a cidade na hora atual, lido da tabela
+    pré-calculada a partir do histórico de trânsito. Sem histórico para a cidade,
+    usa uma estimativa pelo porte da cidade.
+    """
+    # Importar o serviço aqui para evitar problemas de importação circular
+    from services.traffic_service import traffic_provider
+    delay = traffic_provider.get_delay(weather_data["city"], hour=datetime.now().hour)
+    if delay is not None:
+        return delay
+    return 15.0 if city_key(weather_data["city"]) in LARGE_CITIES else 5.0
+
+
+def build_iqv_result(weather_data: Dict[str, Any], aqi: int, noise_db: float,
+                     avg_traffic_delay: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Combina os dados climáticos, de qualidade do ar e ruído com o trânsito
+    estimado (ou já consultado pelo chamador) e os componentes do IQV no
+    formato retornado por /api/iqv.
+    """
+    if avg_traffic_delay is None:
+        avg_traffic_delay = estimate_traffic_delay(weather_data)
+    iqv_data = calculate_iqv(
+        temperature=weather_data["temperature"],
+        humidity=weather_data["humidity"],
+        traffic_delay=avg_traffic_delay,
+        aqi=aqi,
+        noise_db=noise_db
+    )
+    return {
+        "city": weather_data["city"],
+        "country": weather_data["country"],
+        "updated_at": weather_data["updated_at"],
+        "temperature": weather_data["temperature"],
+        "description": weather_data["description"],
+        "humidity": weather_data["humidity"],
+        "avg_traffic_delay_min": avg_traffic_delay,
+        "aqi": aqi,
+        "noise_db": noise_db,
+        "latitude": weather_data["latitude"],
+        "longitude": weather_data["longitude"],
+        **iqv_data
+    }
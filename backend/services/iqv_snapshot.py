@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import os
+import time
+from array import array
+from typing import Any, Dict, List, Optional
+
+from services.iqv_service import build_iqv_result, city_key, normalize_city_name
+
+logger = logging.getLogger(__name__)
+
+# Cidades mais consultadas, pré-calculadas periodicamente (sobrescreva com IQV_SNAPSHOT_CITIES)
+DEFAULT_SNAPSHOT_CITIES = [
+    "São Paulo", "Rio de Janeiro", "Belo Horizonte", "Porto Alegre", "Salvador",
+    "Brasília", "Fortaleza", "Manaus", "Curitiba", "Recife",
+    "London", "Paris", "Berlin", "Madrid", "Rome", "Tokyo", "New York",
+    "Los Angeles", "Buenos Aires", "Mexico City"
+]
+SNAPSHOT_REFRESH_SECONDS = int(os.getenv("IQV_SNAPSHOT_REFRESH_SECONDS", 600))
+# Máximo de cidades buscadas em paralelo durante a reconstrução
+SNAPSHOT_CONCURRENCY = int(os.getenv("IQV_SNAPSHOT_CONCURRENCY", 10))
+
+TEXT_COLUMNS = ("city", "country", "description")
+NUMERIC_COLUMNS = (
+    "updated_at", "temperature", "humidity", "avg_traffic_delay_min", "aqi", "noise_db",
+    "latitude", "longitude", "iqv_climate", "iqv_humidity", "iqv_traffic", "iqv_trend",
+    "iqv_air", "iqv_noise", "iqv_overall"
+)
+IQV_COLUMNS = (
+    "iqv_climate", "iqv_humidity", "iqv_traffic", "iqv_trend", "iqv_air", "iqv_noise", "iqv_overall"
+)
+INTEGER_COLUMNS = ("updated_at", "humidity", "aqi")
+
+
+def get_snapshot_cities() -> List[str]:
+    """Lê a lista de cidades do snapshot a partir do ambiente"""
+    configured = os.getenv("IQV_SNAPSHOT_CITIES")
+    if not configured:
+        return list(DEFAULT_SNAPSHOT_CITIES)
+    return [city.strip() for city in configured.split(",") if city.strip()]
+
+
+class IQVSnapshot:
+    """
+    Tabela imutável e compacta (uma coluna `array` por campo numérico) com o
+    último clima e todos os componentes do IQV por cidade. Nunca é alterada
+    depois de construída: a atualização cria uma nova instância e troca a referência.
+    """
+
+    def __init__(self, rows: List[Dict[str, Any]], aliases: Optional[Dict[str, str]] = None):
+        self.built_at = time.time()
+        self.text = {name: [] for name in TEXT_COLUMNS}
+        self.columns = {name: array("d") for name in NUMERIC_COLUMNS}
+        self._index: Dict[str, int] = {}
+
+        for row_id, row in enumerate(rows):
+            for name in TEXT_COLUMNS:
+                self.text[name].append(row[name])
+            for name in NUMERIC_COLUMNS:
+                self.columns[name].append(float(row[name]))
+            self._index[city_key(row["city"])] = row_id
+
+        # Nome consultado -> nome retornado pelo OpenWeather (ex.: "Sao Paulo" -> "São Paulo")
+        for alias, city in (aliases or {}).items():
+            row_id = self._index.get(city_key(city))
+            if row_id is not None:
+                self._index.setdefault(city_key(alias), row_id)
+
+    def __len__(self) -> int:
+        return len(self.text["city"])
+
+    def _row(self, row_id: int) -> Dict[str, Any]:
+        row: Dict[str, Any] = {name: self.text[name][row_id] for name in TEXT_COLUMNS}
+        for name in NUMERIC_COLUMNS:
+            value = self.columns[name][row_id]
+            row[name] = int(value) if name in INTEGER_COLUMNS else value
+        return row
+
+    def get(self, city: str) -> Optional[Dict[str, Any]]:
+        """Busca O(1) pelo nome da cidade; retorna None se ela não estiver no snapshot"""
+        row_id = self._index.get(city_key(city))
+        if row_id is None:
+            return None
+        return self._row(row_id)
+
+    def rows(self) -> List[Dict[str, Any]]:
+        """Retorna todas as linhas do snapshot"""
+        return [self._row(row_id) for row_id in range(len(self))]
+
+
+_current_snapshot = IQVSnapshot([])
+
+
+def get_snapshot() -> IQVSnapshot:
+    """Retorna o snapshot vigente (a referência é trocada atomicamente na reconstrução)"""
+    return _current_snapshot
+
+
+async def build_snapshot(cities: List[str], previous: Optional[IQVSnapshot] = None) -> IQVSnapshot:
+    """
+    Busca clima, qualidade do ar e ruído de cada cidade (com concorrência
+    limitada) e calcula o IQV. Cidades que falharem mantêm a linha do snapshot
+    anterior, se houver.
+    """
+    from services.weather_service import fetch_current_weather_batch, get_city_environment
+
+    queries: List[str] = []
+    seen_queries = set()
+    for city in cities:
+        if city_key(city) not in seen_queries:
+            seen_queries.add(city_key(city))
+            queries.append(city)
+
+    # Pré-carrega o clima de todas as cidades com chamadas em lote (/group); as
+    # buscas individuais abaixo passam a ser atendidas pelo cache compartilhado
+    try:
+        await asyncio.to_thread(fetch_current_weather_batch, [normalize_city_name(city) for city in queries])
+    except Exception as e:
+        logger.warning(f"Falha na busca em lote do snapshot: {e}")
+
+    semaphore = asyncio.Semaphore(SNAPSHOT_CONCURRENCY)
+
+    async def fetch(city: str) -> Optional[Dict[str, Any]]:
+        async with semaphore:
+            try:
+                return build_iqv_result(*await get_city_environment(normalize_city_name(city)))
+            except Exception as e:
+                logger.warning(f"Falha ao atualizar snapshot para {city}: {e}")
+                return previous.get(city) if previous is not None else None
+
+    rows: List[Dict[str, Any]] = []
+    aliases: Dict[str, str] = {}
+    seen_rows = set()
+    for city, row in zip(queries, await asyncio.gather(*(fetch(city) for city in queries))):
+        if row is None:
+            continue
+        aliases[city] = row["city"]
+        if city_key(row["city"]) not in seen_rows:
+            seen_rows.add(city_key(row["city"]))
+            rows.append(row)
+    return IQVSnapshot(rows, aliases)
+
+
+async def refresh_snapshot(cities: Optional[List[str]] = None) -> IQVSnapshot:
+    """Reconstrói o snapshot e o publica com uma única troca de referência"""
+    global _current_snapshot
+    cities = cities if cities is not None else get_snapshot_cities()
+    started = time.perf_counter()
+    snapshot = await build_snapshot(cities, previous=_current_snapshot)
+    _current_snapshot = snapshot
+    logger.info(
+        f"Snapshot de IQV reconstruído: {len(snapshot)} cidades em "
+        f"{time.perf_counter() - started:.2f}s"
+    )
+    return snapshot
@@ -0,0 +1,188 @@
+import math
+import random
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from services.iqv_service import city_key
+from services.iqv_snapshot import IQV_COLUMNS
+
+
+class _Node:
+    __slots__ = ("value", "next", "width")
+
+    def __init__(self, value, levels: int):
+        self.value = value
+        self.next: List["_Node"] = [None] * levels
+        self.width: List[int] = [1] * levels
+
+
+class IndexableSkipList:
+    """
+    Lista ordenada (skiplist com larguras) com inserção, remoção e acesso por
+    posição em O(log n). Os valores precisam ser únicos e comparáveis.
+    """
+
+    def __init__(self, expected_size: int = 65536):
+        self.size = 0
+        self.max_levels = max(1, int(1 + math.log2(expected_size)))
+        self._nil = _Node(None, 0)
+        self._head = _Node(None, self.max_levels)
+        self._head.next = [self._nil] * self.max_levels
+
+    def __len__(self) -> int:
+        return self.size
+
+    def insert(self, value) -> None:
+        chain = [None] * self.max_levels
+        steps_at_level = [0] * self.max_levels
+        node = self._head
+        for level in reversed(range(self.max_levels)):
+            while node.next[level] is not self._nil and node.next[level].value <= value:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+
+        levels = min(self.max_levels, 1 - int(math.log2(1.0 - random.random())))
+        new_node = _Node(value, levels)
+        steps = 0
+        for level in range(levels):
+            prev_node = chain[level]
+            new_node.next[level] = prev_node.next[level]
+            prev_node.next[level] = new_node
+            new_node.width[level] = prev_node.width[level] - steps
+            prev_node.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(levels, self.max_levels):
+            chain[level].width[level] += 1
+        self.size += 1
+
+    def remove(self, value) -> None:
+        chain = [None] * self.max_levels
+        node = self._head
+        for level in reversed(range(self.max_levels)):
+            while node.next[level] is not self._nil and node.next[level].value < value:
+                node = node.next[level]
+            chain[level] = node
+
+        target = chain[0].next[0]
+        if target is self._nil or target.value != value:
+            raise KeyError(value)
+        for level in range(len(target.next)):
+            prev_node = chain[level]
+            prev_node.width[level] += target.width[level] - 1
+            prev_node.next[level] = target.next[level]
+        for level in range(len(target.next), self.max_levels):
+            chain[level].width[level] -= 1
+        self.size -= 1
+
+    def _node_at(self, index: int) -> _Node:
+        node = self._head
+        remaining = index + 1
+        for level in reversed(range(self.max_levels)):
+            while node.width[level] <= remaining and node.next[level] is not self._nil:
+                remaining -= node.width[level]
+                node = node.next[level]
+        return node
+
+    def slice(self, start: int, count: int) -> List[Any]:
+        """Retorna até `count` valores a partir da posição `start` (O(log n + k))"""
+        if start < 0 or start >= self.size or count <= 0:
+            return []
+        node = self._node_at(start)
+        values = []
+        while node is not self._nil and len(values) < count:
+            values.append(node.value)
+            node = node.next[0]
+        return values
+
+
+class Leaderboard:
+    """
+    Índice de ranking mantido incrementalmente: uma skiplist por componente do
+    IQV (global e por país). Cada atualização de cidade custa O(log n) por índice.
+    """
+
+    def __init__(self, metrics=IQV_COLUMNS):
+        self.metrics = tuple(metrics)
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._global = {metric: IndexableSkipList() for metric in self.metrics}
+        self._by_country: Dict[str, Dict[str, IndexableSkipList]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _indexes_for(self, country: str) -> List[Dict[str, IndexableSkipList]]:
+        country = str(country).upper()
+        if country not in self._by_country:
+            self._by_country[country] = {metric: IndexableSkipList() for metric in self.metrics}
+        return [self._global, self._by_country[country]]
+
+    def _sort_key(self, row: Dict[str, Any], metric: str, key: str) -> Tuple[float, str]:
+        # Score negado: a ordem crescente da skiplist corresponde ao maior IQV primeiro
+        return (-float(row[metric]), key)
+
+    def _unindex(self, key: str, row: Dict[str, Any]) -> None:
+        for indexes in self._indexes_for(row["country"]):
+            for metric in self.metrics:
+                indexes[metric].remove(self._sort_key(row, metric, key))
+
+    def _index(self, key: str, row: Dict[str, Any]) -> None:
+        for indexes in self._indexes_for(row["country"]):
+            for metric in self.metrics:
+                indexes[metric].insert(self._sort_key(row, metric, key))
+
+    def update(self, row: Dict[str, Any]) -> bool:
+        """
+        Registra os dados mais recentes de uma cidade. Retorna False se nenhum
+        score mudou (nesse caso os índices não são tocados).
+        """
+        key = city_key(row["city"])
+        with self._lock:
+            previous = self._entries.get(key)
+            unchanged = previous is not None and previous["country"] == row["country"] and all(
+                float(previous[metric]) == float(row[metric]) for metric in self.metrics
+            )
+            self._entries[key] = dict(row)
+            if unchanged:
+                return False
+            if previous is not None:
+                self._unindex(key, previous)
+            self._index(key, row)
+            return True
+
+    def remove(self, city: str) -> None:
+        """Remove uma cidade de todos os índices"""
+        key = city_key(city)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._unindex(key, previous)
+
+    def query(self, metric: str = "iqv_overall", limit: int = 20, offset: int = 0,
+              ascending: bool = False, country: Optional[str] = None) -> Dict[str, Any]:
+        """Top-K (ou bottom-K com `ascending`) paginado, opcionalmente filtrado por país"""
+        if metric not in self.metrics:
+            raise ValueError(f"Métrica de ranking inválida: {metric}")
+        limit = max(0, limit)
+        offset = max(0, offset)
+        with self._lock:
+            if country is None:
+                index = self._global[metric]
+            else:
+                index = self._by_country.get(country.upper(), {}).get(metric)
+            total = len(index) if index is not None else 0
+            if index is None or offset >= total:
+                keys = []
+            elif ascending:
+                # Bottom-K: percorre a mesma skiplist a partir do final
+                end = total - offset
+                start = max(0, end - limit)
+                keys = list(reversed(index.slice(start, end - start)))
+            else:
+                keys = index.slice(offset, limit)
+            rows = [dict(self._entries[key]) for _, key in keys]
+        return {"total": total, "cities": rows}
+
+
+leaderboard = Leaderboard()
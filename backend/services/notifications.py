@@ -0,0 +1,135 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+from typing import Any, AsyncIterator, Dict, Iterable, Optional
+
+from services.iqv_service import city_key
+
+logger = logging.getLogger(__name__)
+
+CLIENT_QUEUE_SIZE = int(os.getenv("SSE_CLIENT_QUEUE_SIZE", 100))
+MAX_DROPPED_EVENTS = int(os.getenv("SSE_MAX_DROPPED_EVENTS", 200))
+HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", 15))
+
+# Severidade do alerta -> tipo exibido pelo NotificationSystem do frontend
+ALERT_NOTIFICATION_TYPES = {"high": "alert", "medium": "warning"}
+
+
+class Subscriber:
+    """Cliente SSE com fila limitada e o conjunto de cidades assinadas (None = todas)"""
+
+    def __init__(self, client_id: int, cities: Optional[Iterable[str]], queue_size: int):
+        self.client_id = client_id
+        self.cities = {city_key(city) for city in cities} if cities else None
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.closed = False
+
+    def wants(self, city_key: Optional[str]) -> bool:
+        return self.cities is None or city_key is None or city_key in self.cities
+
+
+class Broadcaster:
+    """
+    Distribui eventos de um único laço de atualização para todos os clientes
+    conectados. Clientes lentos perdem os eventos mais antigos da fila e são
+    desconectados quando acumulam descartes demais.
+    """
+
+    def __init__(self, queue_size: int = CLIENT_QUEUE_SIZE, max_dropped: int = MAX_DROPPED_EVENTS):
+        self.queue_size = queue_size
+        self.max_dropped = max_dropped
+        self._ids = itertools.count(1)
+        self._subscribers: Dict[int, Subscriber] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+    def attach_loop(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Registra o event loop que atende as conexões SSE"""
+        self._loop = loop
+
+    def subscribe(self, cities: Optional[Iterable[str]] = None) -> Subscriber:
+        subscriber = Subscriber(next(self._ids), cities, self.queue_size)
+        self._subscribers[subscriber.client_id] = subscriber
+        logger.info(f"Cliente SSE {subscriber.client_id} conectado ({len(self)} ativos)")
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        subscriber.closed = True
+        if self._subscribers.pop(subscriber.client_id, None) is not None:
+            logger.info(f"Cliente SSE {subscriber.client_id} desconectado ({len(self)} ativos)")
+
+    def _fan_out(self, event: Dict[str, Any], city_key: Optional[str]) -> None:
+        for subscriber in list(self._subscribers.values()):
+            if not subscriber.wants(city_key):
+                continue
+            if subscriber.queue.full():
+                subscriber.queue.get_nowait()
+                subscriber.dropped += 1
+                if subscriber.dropped > self.max_dropped:
+                    logger.warning(f"Cliente SSE {subscriber.client_id} lento demais; desconectando")
+                    self.unsubscribe(subscriber)
+                    continue
+            subscriber.queue.put_nowait(event)
+
+    def publish(self, event: Dict[str, Any], city: Optional[str] = None) -> None:
+        """
+        Publica um evento para os assinantes da cidade. Pode ser chamado de
+        qualquer thread; a distribuição sempre ocorre no event loop.
+        """
+        if self._loop is None or not self._subscribers:
+            return
+        city_key = city_key(city) if city else None
+        self._loop.call_soon_threadsafe(self._fan_out, event, city_key)
+
+
+def format_sse(event: Dict[str, Any]) -> str:
+    """Serializa um evento no formato text/event-stream (evento padrão `message`)"""
+    return f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+async def event_stream(broadcaster: Broadcaster, subscriber: Subscriber, is_disconnected,
+                       heartbeat_seconds: float = HEARTBEAT_SECONDS) -> AsyncIterator[str]:
+    """Gera o fluxo SSE de um cliente, com comentários de heartbeat quando ocioso"""
+    try:
+        yield "retry: 5000\n\n"
+        while not subscriber.closed:
+            if await is_disconnected():
+                break
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(), timeout=heartbeat_seconds)
+            except asyncio.TimeoutError:
+                yield ": heartbeat\n\n"
+                continue
+            yield format_sse(event)
+    finally:
+        broadcaster.unsubscribe(subscriber)
+
+
+def iqv_event(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Evento de mudança de IQV de uma cidade"""
+    return {
+        "type": "iqv",
+        "city": result["city"],
+        "iqv_overall": result["iqv_overall"],
+        "updated_at": result["updated_at"],
+        "message": f"IQV de {result['city']} atualizado: {result['iqv_overall']}"
+    }
+
+
+def alert_event(city: str, alert: Dict[str, Any]) -> Dict[str, Any]:
+    """Evento de alerta climático no formato esperado pelo NotificationSystem"""
+    return {
+        "type": ALERT_NOTIFICATION_TYPES.get(alert["severity"], "info"),
+        "city": city,
+        "alert_type": alert["type"],
+        "severity": alert["severity"],
+        "message": f"{city}: {alert['message']}"
+    }
+
+
+broadcaster = Broadcaster()
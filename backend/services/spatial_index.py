@@ -0,0 +1,162 @@
+import math
+import os
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from services.iqv_service import city_key
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+SPATIAL_CELL_SIZE_DEG = float(os.getenv("SPATIAL_CELL_SIZE_DEG", 1.0))
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Distância de grande círculo entre dois pontos, em km"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class SpatialIndex:
+    """
+    Grade regular lat/lon (células de `cell_size` graus) com as cidades que
+    possuem dados recentes. Suporta consultas por retângulo (viewport do mapa)
+    e k vizinhos mais próximos por busca em anéis de células.
+    """
+
+    def __init__(self, cell_size: float = SPATIAL_CELL_SIZE_DEG):
+        self.cell_size = cell_size
+        self.n_lat = int(math.ceil(180 / cell_size))
+        self.n_lon = int(math.ceil(360 / cell_size))
+        self._lock = threading.Lock()
+        self._cells: Dict[Tuple[int, int], Set[str]] = {}
+        self._points: Dict[str, Tuple[float, float, Tuple[int, int], Dict[str, Any]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._points)
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        i = min(self.n_lat - 1, max(0, int((lat + 90) // self.cell_size)))
+        j = int(((lon + 180) % 360) // self.cell_size) % self.n_lon
+        return i, j
+
+    def update(self, row: Dict[str, Any]) -> None:
+        """Insere ou move uma cidade na grade"""
+        key = city_key(row["city"])
+        lat, lon = float(row["latitude"]), float(row["longitude"])
+        cell = self._cell(lat, lon)
+        with self._lock:
+            previous = self._points.get(key)
+            if previous is not None and previous[2] != cell:
+                self._discard(key, previous[2])
+            self._cells.setdefault(cell, set()).add(key)
+            self._points[key] = (lat, lon, cell, dict(row))
+
+    def remove(self, city: str) -> None:
+        key = city_key(city)
+        with self._lock:
+            previous = self._points.pop(key, None)
+            if previous is not None:
+                self._discard(key, previous[2])
+
+    def _discard(self, key: str, cell: Tuple[int, int]) -> None:
+        members = self._cells.get(cell)
+        if members is not None:
+            members.discard(key)
+            if not members:
+                del self._cells[cell]
+
+    def _lon_columns(self, min_lon: float, max_lon: float) -> Iterable[int]:
+        start = self._cell(0, min_lon)[1]
+        end = self._cell(0, max_lon)[1]
+        if min_lon <= max_lon and max_lon - min_lon >= 360:
+            return range(self.n_lon)
+        if start <= end and min_lon <= max_lon:
+            return range(start, end + 1)
+        # Viewport cruzando o antimeridiano
+        return list(range(start, self.n_lon)) + list(range(0, end + 1))
+
+    def within_bbox(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float,
+                    limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Cidades dentro do retângulo; `min_lon > max_lon` indica cruzamento do antimeridiano"""
+        crosses = min_lon > max_lon
+
+        def inside(lat: float, lon: float) -> bool:
+            if not (min_lat <= lat <= max_lat):
+                return False
+            return (lon >= min_lon or lon <= max_lon) if crosses else (min_lon <= lon <= max_lon)
+
+        with self._lock:
+            lat_rows = range(self._cell(min_lat, 0)[0], self._cell(max_lat, 0)[0] + 1)
+            lon_columns = list(self._lon_columns(min_lon, max_lon))
+            if len(lat_rows) * len(lon_columns) > len(self._cells):
+                # Viewport maior que a área ocupada: varre apenas as células não vazias
+                cells = list(self._cells)
+            else:
+                cells = [(i, j) for i in lat_rows for j in lon_columns if (i, j) in self._cells]
+            results = []
+            for cell in cells:
+                for key in self._cells[cell]:
+                    lat, lon, _, row = self._points[key]
+                    if inside(lat, lon):
+                        results.append(dict(row))
+        results.sort(key=lambda row: row["iqv_overall"], reverse=True)
+        return results[:limit] if limit is not None else results
+
+    def _ring(self, ci: int, cj: int, ring: int) -> Iterable[Tuple[int, int]]:
+        if ring == 0:
+            yield ci, cj
+            return
+        for di in range(-ring, ring + 1):
+            i = ci + di
+            if i < 0 or i >= self.n_lat:
+                continue
+            if abs(di) == ring:
+                offsets = range(-ring, ring + 1)
+            else:
+                offsets = (-ring, ring)
+            for dj in offsets:
+                yield i, (cj + dj) % self.n_lon
+
+    def _ring_lower_bound_km(self, lat: float, ring: int) -> float:
+        """Distância mínima (aproximada) até qualquer célula fora dos anéis já visitados"""
+        lat_bound = ring * self.cell_size * KM_PER_DEGREE
+        polar_lat = min(90.0, abs(lat) + (ring + 1) * self.cell_size)
+        lon_bound = lat_bound * math.cos(math.radians(polar_lat))
+        return min(lat_bound, lon_bound)
+
+    def nearest(self, lat: float, lon: float, k: int = 5) -> List[Dict[str, Any]]:
+        """k cidades mais próximas de um ponto, com a distância em km"""
+        if k <= 0:
+            return []
+        with self._lock:
+            ci, cj = self._cell(lat, lon)
+            candidates: Dict[str, float] = {}
+            ring = 0
+            while True:
+                if (2 * ring + 1) ** 2 > len(self._cells):
+                    # Os anéis já cobrem mais células do que as ocupadas: busca exaustiva
+                    keys: Iterable[str] = self._points
+                else:
+                    keys = [key for cell in self._ring(ci, cj, ring) for key in self._cells.get(cell, ())]
+                for key in keys:
+                    if key not in candidates:
+                        point_lat, point_lon = self._points[key][:2]
+                        candidates[key] = haversine_km(lat, lon, point_lat, point_lon)
+                if keys is self._points:
+                    break
+                if len(candidates) >= k:
+                    kth_distance = sorted(candidates.values())[k - 1]
+                    if kth_distance <= self._ring_lower_bound_km(lat, ring):
+                        break
+                ring += 1
+            best = sorted(candidates.items(), key=lambda item: item[1])[:k]
+            return [
+                {**self._points[key][3], "distance_km": round(distance, 2)}
+                for key, distance in best
+            ]
+
+
+spatial_index = SpatialIndex()
@@ -0,0 +1,93 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+from services.iqv_service import city_key
+
+logger = logging.getLogger(__name__)
+
+TRAFFIC_HISTORY_DIR = Path(os.getenv(
+    "TRAFFIC_HISTORY_DIR", Path(__file__).parent.parent / "data" / "traffic_history"
+))
+# Janela de histórico usada nas médias por cidade e hora
+TRAFFIC_LOOKBACK_DAYS = int(os.getenv("TRAFFIC_LOOKBACK_DAYS", 28))
+# Intervalo entre verificações de mudança nos arquivos do histórico
+TRAFFIC_CHECK_SECONDS = int(os.getenv("TRAFFIC_CHECK_SECONDS", 60))
+
+
+class TrafficProvider:
+    """
+    Tabela em memória de atraso médio de trânsito (minutos) por cidade e hora
+    do dia, pré-calculada a partir do histórico Parquet de trânsito. A consulta
+    é um acesso O(1) a dicionário/array; a tabela é recalculada em segundo plano
+    apenas quando os arquivos do histórico mudam e trocada atomicamente.
+    """
+
+    def __init__(self, history_dir: Path = TRAFFIC_HISTORY_DIR, lookback_days: int = TRAFFIC_LOOKBACK_DAYS,
+                 key: Callable[[str], str] = str.casefold):
+        self.history_dir = Path(history_dir)
+        self.lookback_days = lookback_days
+        self.key = key
+        self.loaded_at: Optional[float] = None
+        self._signature: Optional[Tuple[int, float]] = None
+        self._reload_lock = threading.Lock()
+        # (por hora: cidade -> array de 24 posições, média geral por cidade)
+        self._table: Tuple[Dict[str, np.ndarray], Dict[str, float]] = ({}, {})
+
+    def _files_signature(self) -> Tuple[int, float]:
+        count, latest = 0, 0.0
+        if self.history_dir.exists():
+            for path in self.history_dir.rglob("*.parquet"):
+                count += 1
+                latest = max(latest, path.stat().st_mtime)
+        return count, latest
+
+    def refresh_if_changed(self) -> bool:
+        """Recalcula a tabela se algum arquivo do histórico foi criado, alterado ou removido"""
+        with self._reload_lock:
+            signature = self._files_signature()
+            if signature == self._signature:
+                return False
+            self._table = self._build_table()
+            self._signature = signature
+            self.loaded_at = time.time()
+            logger.info(f"Tabela de trânsito recalculada: {len(self._table[1])} cidades")
+            return True
+
+    def _build_table(self) -> Tuple[Dict[str, np.ndarray], Dict[str, float]]:
+        from pipelines.parquet_history import ParquetHistory
+
+        history = ParquetHistory(self.history_dir, key_columns=("route", "timestamp"))
+        start = datetime.now() - timedelta(days=self.lookback_days)
+        df = history.read(columns=["city", "timestamp", "delay"], start=start)
+        if df.empty:
+            return {}, {}
+        df["city"] = df["city"].astype(str).map(self.key)
+        df["hour"] = df["timestamp"].dt.hour
+        by_hour = df.groupby(["city", "hour"])["delay"].mean() / 60
+        by_city = df.groupby("city")["delay"].mean() / 60
+
+        hourly: Dict[str, np.ndarray] = {}
+        for (city, hour), minutes in by_hour.items():
+            hourly.setdefault(city, np.full(24, np.nan))[hour] = round(float(minutes), 1)
+        overall = {city: round(float(minutes), 1) for city, minutes in by_city.items()}
+        return hourly, overall
+
+    def get_delay(self, city: str, hour: Optional[int] = None) -> Optional[float]:
+        """Atraso médio esperado em minutos para a cidade (e hora), ou None sem dados"""
+        hourly, overall = self._table
+        key = self.key(city)
+        if hour is not None and key in hourly:
+            minutes = hourly[key][hour]
+            if not np.isnan(minutes):
+                return float(minutes)
+        return overall.get(key)
+
+
+traffic_provider = TrafficProvider(key=city_key)
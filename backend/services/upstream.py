@@ -0,0 +1,69 @@
+import asyncio
+import threading
+import time
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+
+class RateLimiter:
+    """
+    Token bucket thread-safe para chamadas a APIs externas. Cada chamada reserva
+    um token; quando o balde está vazio, a espera é proporcional à fila formada.
+    Funciona tanto em threads (acquire) quanto no event loop (acquire_async).
+    """
+
+    def __init__(self, rate_per_second: float, burst: int = 1):
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate_per_second)
+            self._updated_at = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate_per_second
+
+    def acquire(self) -> None:
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self) -> None:
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class TTLCache:
+    """Cache thread-safe em memória com expiração por entrada"""
+
+    def __init__(self, ttl_seconds: float, max_entries: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: Dict[Hashable, Tuple[float, Any]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if len(self._entries) >= self.max_entries:
+                for expired in [k for k, (expires_at, _) in self._entries.items() if expires_at <= now]:
+                    del self._entries[expired]
+                if len(self._entries) >= self.max_entries:
+                    del self._entries[next(iter(self._entries))]
+            self._entries[key] = (now + self.ttl_seconds, value)
@@ -1,10 +1,17 @@
 from datetime import datetime, timezone
+import asyncio
+import json
 import os
+import threading
+import time
+from pathlib import Path
 import requests
-from typing import Dict, Any
+from typing import Dict, Any, Awaitable, List, Optional, Tuple
 import logging
 from dotenv import load_dotenv
 import httpx
+from services.geo_cache import geo_cache
+from services.upstream import RateLimiter, TTLCache
 
 load_dotenv()
 
@@ -24,31 +31,184 @@ if not API_KEY:
     logger.error("OPENWEATHER_API_KEY não está definida nas variáveis de ambiente")
     raise RuntimeError("OPENWEATHER_API_KEY é obrigatória")
 
+WEATHER_URL = "http://api.openweathermap.org/data/2.5/weather"
+GROUP_URL = "http://api.openweathermap.org/data/2.5/group"
+# Máximo de IDs aceitos pelo endpoint /group em uma única chamada
+GROUP_MAX_IDS = 20
+REQUEST_TIMEOUT_SECONDS = 10
+# IDs de cidade do OpenWeather aprendidos nas consultas por nome (usados no /group)
+CITY_IDS_FILE = Path(os.getenv("CITY_IDS_FILE", Path(__file__).parent.parent / "data" / "city_ids.json"))
+# Valores usados quando a API de poluição do ar ou de ruído falha
+DEFAULT_AQI = 3
+DEFAULT_NOISE_DB = 65.0
+
+# Limite de chamadas ao OpenWeather (plano gratuito: 60/min) e cache das respostas de /weather,
+# compartilhados por todos os consumidores do processo (API, snapshot e ETL)
+openweather_limiter = RateLimiter(
+    rate_per_second=float(os.getenv("OPENWEATHER_CALLS_PER_MINUTE", 60)) / 60,
+    burst=int(os.getenv("OPENWEATHER_BURST", 10))
+)
+# Caches: /weather (WEATHER_CACHE_TTL_SECONDS), /forecast (FORECAST_CACHE_TTL_SECONDS) e
+# ar/ruído por célula de coordenadas (GEO_CACHE_TTL_SECONDS, em services/geo_cache.py)
+weather_cache = TTLCache(ttl_seconds=int(os.getenv("WEATHER_CACHE_TTL_SECONDS", 600)))
+# Intervalo entre os horários da previsão de 5 dias / 3 horas; o primeiro horário
+# (`list[0].dt`) avança um passo a cada nova rodada publicada pelo OpenWeather
+FORECAST_STEP_SECONDS = 3 * 60 * 60
+forecast_cache = TTLCache(ttl_seconds=int(os.getenv("FORECAST_CACHE_TTL_SECONDS", FORECAST_STEP_SECONDS)))
+
+# Sessão HTTP síncrona compartilhada (pool de conexões)
+_session = requests.Session()
+
+# Cliente HTTP assíncrono compartilhado (reaproveita conexões entre requisições)
+_async_client: Optional[httpx.AsyncClient] = None
+
+def get_async_client() -> httpx.AsyncClient:
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(timeout=httpx.Timeout(REQUEST_TIMEOUT_SECONDS))
+    return _async_client
+
+def _parse_weather(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Converte a resposta do endpoint /weather no formato usado pela API"""
+    return {
+        "city": data["name"],
+        "country": data["sys"]["country"],
+        "temperature": round(data["main"]["temp"], 1),
+        "description": data["weather"][0]["description"].title(),
+        "humidity": data["main"]["humidity"],
+        "latitude": data["coord"]["lat"],
+        "longitude": data["coord"]["lon"],
+        "updated_at": data["dt"]
+    }
+
+_city_ids: Optional[Dict[str, int]] = None
+_city_ids_lock = threading.Lock()
+
+def _load_city_ids() -> Dict[str, int]:
+    global _city_ids
+    if _city_ids is None:
+        try:
+            _city_ids = json.loads(CITY_IDS_FILE.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            _city_ids = {}
+    return _city_ids
+
+def get_city_id(city: str) -> Optional[int]:
+    with _city_ids_lock:
+        return _load_city_ids().get(city.casefold())
+
+def remember_city_id(city: str, data: Dict[str, Any]) -> None:
+    """Guarda o ID OpenWeather retornado para a cidade consultada (persistido em CITY_IDS_FILE)"""
+    city_id = data.get("id")
+    if not city_id:
+        return
+    with _city_ids_lock:
+        city_ids = _load_city_ids()
+        if city_ids.get(city.casefold()) == city_id:
+            return
+        city_ids[city.casefold()] = city_id
+        try:
+            CITY_IDS_FILE.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = CITY_IDS_FILE.with_suffix(".tmp")
+            tmp_path.write_text(json.dumps(city_ids, ensure_ascii=False, indent=2), encoding="utf-8")
+            os.replace(tmp_path, CITY_IDS_FILE)
+        except OSError as e:
+            logger.warning(f"Não foi possível salvar IDs de cidade em {CITY_IDS_FILE}: {e}")
+
+def fetch_current_weather(city: str) -> Dict[str, Any]:
+    """
+    Retorna a resposta bruta do endpoint /weather, passando pelo cache e pelo
+    limitador de chamadas compartilhados.
+    """
+    key = city.casefold()
+    cached = weather_cache.get(key)
+    if cached is not None:
+        return cached
+    openweather_limiter.acquire()
+    response = _session.get(
+        WEATHER_URL,
+        params={"q": city, "units": "metric", "appid": API_KEY},
+        timeout=REQUEST_TIMEOUT_SECONDS
+    )
+    response.raise_for_status()
+    data = response.json()
+    weather_cache.set(key, data)
+    remember_city_id(city, data)
+    return data
+
+def fetch_current_weather_batch(cities: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Busca várias cidades com o mínimo de requisições: cidades com ID conhecido são
+    agrupadas em chamadas ao endpoint /group (até GROUP_MAX_IDS por chamada); as
+    demais são consultadas por nome, o que registra o ID para os próximos lotes.
+    Retorna {cidade consultada: resposta bruta no formato do /weather}; cidades
+    que falharem ficam de fora.
+    """
+    results: Dict[str, Dict[str, Any]] = {}
+    by_id: Dict[int, List[str]] = {}
+    unknown: List[str] = []
+    for city in cities:
+        cached = weather_cache.get(city.casefold())
+        if cached is not None:
+            results[city] = cached
+            continue
+        city_id = get_city_id(city)
+        if city_id is None:
+            unknown.append(city)
+        else:
+            by_id.setdefault(city_id, []).append(city)
+
+    ids = list(by_id)
+    for start in range(0, len(ids), GROUP_MAX_IDS):
+        chunk = ids[start:start + GROUP_MAX_IDS]
+        try:
+            openweather_limiter.acquire()
+            response = _session.get(
+                GROUP_URL,
+                params={"id": ",".join(str(city_id) for city_id in chunk), "units": "metric", "appid": API_KEY},
+                timeout=REQUEST_TIMEOUT_SECONDS
+            )
+            response.raise_for_status()
+            items = response.json().get("list", [])
+        except Exception as e:
+            logger.error(f"Erro ao buscar lote de {len(chunk)} cidades: {e}")
+            # Recupera as cidades do lote individualmente
+            unknown.extend(city for city_id in chunk for city in by_id[city_id])
+            continue
+        returned = set()
+        for item in items:
+            returned.add(item.get("id"))
+            for city in by_id.get(item.get("id"), []):
+                weather_cache.set(city.casefold(), item)
+                results[city] = item
+        unknown.extend(city for city_id in chunk if city_id not in returned for city in by_id[city_id])
+
+    for city in unknown:
+        try:
+            results[city] = fetch_current_weather(city)
+        except Exception as e:
+            logger.warning(f"Falha ao buscar clima para {city}: {e}")
+    logger.info(
+        f"Clima obtido para {len(results)}/{len(cities)} cidades "
+        f"({(len(ids) + GROUP_MAX_IDS - 1) // GROUP_MAX_IDS} chamadas em lote)"
+    )
+    return results
+
+def get_weather_data_batch(cities: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Versão em lote de get_weather_data: {cidade consultada: dados no mesmo formato}"""
+    return {city: _parse_weather(data) for city, data in fetch_current_weather_batch(cities).items()}
+
 def get_weather_data(city: str) -> Dict[str, Any]:
     logger.info(f"Buscando dados climáticos para: {city}")
-    url = f"http://api.openweathermap.org/data/2.5/weather?q={city}&units=metric&appid={API_KEY}"
-    
-    response = None  # ✅ Adicione esta linha
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
+        data = fetch_current_weather(city)
         
-        result = {
-            "city": data["name"],
-            "country": data["sys"]["country"],
-            "temperature": round(data["main"]["temp"], 1),
-            "description": data["weather"][0]["description"].title(),
-            "humidity": data["main"]["humidity"],
-            "latitude": data["coord"]["lat"],
-            "longitude": data["coord"]["lon"],
-            "updated_at": data["dt"]
-        }
+        result = _parse_weather(data)
         logger.info(f"Dados climáticos obtidos com sucesso para {city}")
         return result
         
     except requests.exceptions.HTTPError as e:
-        if response is not None and response.status_code == 404:
+        if e.response is not None and e.response.status_code == 404:
             logger.warning(f"Cidade não encontrada: {city}")
             raise ValueError(f"Cidade '{city}' não encontrada")
         else:
@@ -58,7 +218,41 @@ def get_weather_data(city: str) -> Dict[str, Any]:
         logger.error(f"Erro inesperado ao buscar dados para {city}: {e}", exc_info=True)
         raise ValueError(f"Erro ao buscar dados climáticos: {e}")
 
-def get_forecast_data(city: str) -> list:
+async def get_weather_data_async(city: str) -> Dict[str, Any]:
+    """Versão assíncrona de get_weather_data, usando o cliente HTTP compartilhado"""
+    logger.info(f"Buscando dados climáticos (async) para: {city}")
+    key = city.casefold()
+    cached = weather_cache.get(key)
+    if cached is not None:
+        return _parse_weather(cached)
+    params = {"q": city, "units": "metric", "appid": API_KEY}
+    try:
+        await openweather_limiter.acquire_async()
+        response = await get_async_client().get(WEATHER_URL, params=params)
+        if response.status_code == 404:
+            logger.warning(f"Cidade não encontrada: {city}")
+            raise ValueError(f"Cidade '{city}' não encontrada")
+        response.raise_for_status()
+        data = response.json()
+        weather_cache.set(key, data)
+        remember_city_id(city, data)
+        return _parse_weather(data)
+    except ValueError:
+        raise
+    except Exception as e:
+        logger.error(f"Erro ao buscar dados para {city}: {e}", exc_info=True)
+        raise ValueError(f"Erro ao buscar dados climáticos: {e}")
+
+def get_forecast_data(city: str) -> Tuple[list, int]:
+    """
+    Previsão diária da cidade e o início da rodada upstream (`list[0].dt` menos
+    um passo), usado como versão no ETag e no max-age. A rodada fica em cache
+    até ser substituída, sem nova chamada ao OpenWeather.
+    """
+    key = city.casefold()
+    cached = forecast_cache.get(key)
+    if cached is not None and cached[1] + FORECAST_STEP_SECONDS > time.time():
+        return cached
     logger.info(f"Buscando previsão para: {city}")
     url = f"http://api.openweathermap.org/data/2.5/forecast?q={city}&units=metric&appid={API_KEY}"
     
@@ -67,6 +261,7 @@ def get_forecast_data(city: str) -> list:
         response = requests.get(url)
         response.raise_for_status()
         data = response.json()
+        updated_at = data["list"][0]["dt"] - FORECAST_STEP_SECONDS
         
         # Agrupar por dia
         daily_forecast = {}
@@ -112,7 +307,8 @@ def get_forecast_data(city: str) -> list:
             })
         
         logger.info(f"Previsão obtida com sucesso para {city}")
-        return forecast
+        forecast_cache.set(key, (forecast, updated_at))
+        return forecast, updated_at
         
     except Exception as e:
         logger.error(f"Erro ao buscar previsão para {city}: {e}", exc_info=True)
@@ -125,18 +321,18 @@ async def get_air_pollution(lat: float, lon: float) -> int:
     logger.info(f"Buscando poluição do ar para coordenadas: {lat}, {lon}")
     url = f"http://api.openweathermap.org/data/2.5/air_pollution?lat={lat}&lon={lon}&appid={API_KEY}"
     
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(url)
-            response.raise_for_status()
-            data = response.json()
-            aqi = data["list"][0]["main"]["aqi"]
-            logger.info(f"Poluição do ar obtida: AQI={aqi}")
-            return aqi
-        except Exception as e:
-            logger.error(f"Erro ao buscar poluição do ar: {e}", exc_info=True)
-            # Retorna valor padrão em caso de erro
-            return 3
+    try:
+        await openweather_limiter.acquire_async()
+        response = await get_async_client().get(url)
+        response.raise_for_status()
+        data = response.json()
+        aqi = data["list"][0]["main"]["aqi"]
+        logger.info(f"Poluição do ar obtida: AQI={aqi}")
+        return aqi
+    except Exception as e:
+        logger.error(f"Erro ao buscar poluição do ar: {e}", exc_info=True)
+        # Propaga o erro para que o cache da célula não guarde o valor padrão
+        raise
 
 async def get_noise_pollution(lat: float, lon: float) -> float:
     """
@@ -145,15 +341,37 @@ async def get_noise_pollution(lat: float, lon: float) -> float:
     logger.info(f"Buscando ruído urbano para coordenadas: {lat}, {lon}")
     url = f"http://api.openweathermap.org/data/2.5/noise?lat={lat}&lon={lon}&appid={API_KEY}"
     
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(url)
-            response.raise_for_status()
-            data = response.json()
-            noise = data["noise"]
-            logger.info(f"Nível de ruído obtido: {noise} dB")
-            return noise
-        except Exception as e:
-            logger.error(f"Erro ao buscar ruído urbano: {e}", exc_info=True)
-            # Retorna valor padrão em caso de erro
-            return 65.0
\ No newline at end of file
+    try:
+        await openweather_limiter.acquire_async()
+        response = await get_async_client().get(url)
+        response.raise_for_status()
+        data = response.json()
+        noise = data["noise"]
+        logger.info(f"Nível de ruído obtido: {noise} dB")
+        return noise
+    except Exception as e:
+        logger.error(f"Erro ao buscar ruído urbano: {e}", exc_info=True)
+        # Propaga o erro para que o cache da célula não guarde o valor padrão
+        raise
+
+async def _with_default(fetch: Awaitable[Any], default: Any) -> Any:
+    """Valor padrão só para esta resposta: falhas não ficam no cache da célula"""
+    try:
+        return await fetch
+    except Exception:
+        return default
+
+async def get_city_environment(city: str) -> Tuple[Dict[str, Any], int, float]:
+    """
+    Obtém clima, qualidade do ar e ruído de uma cidade. A chamada de clima
+    fornece as coordenadas; em seguida ar e ruído são buscados em paralelo,
+    somando no máximo uma ida e volta extra ao tempo de resposta. Ar e ruído
+    são cacheados por célula da grade de coordenadas (ver geo_cache).
+    """
+    weather_data = await get_weather_data_async(city)
+    lat, lon = weather_data["latitude"], weather_data["longitude"]
+    aqi, noise_db = await asyncio.gather(
+        _with_default(geo_cache.get_or_fetch("air", lat, lon, get_air_pollution), DEFAULT_AQI),
+        _with_default(geo_cache.get_or_fetch("noise", lat, lon, get_noise_pollution), DEFAULT_NOISE_DB)
+    )
+    return weather_data, aqi, noise_db
\ No newline at end of file
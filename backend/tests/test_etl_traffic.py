@@ -0,0 +1,139 @@
+import importlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+SLOW_SECONDS = 1.0
+GOOD_DELAY_SECONDS = 0.1
+
+
+def directions_body(duration, duration_in_traffic):
+    return {
+        "status": "OK",
+        "routes": [{"legs": [{
+            "duration": {"value": duration},
+            "duration_in_traffic": {"value": duration_in_traffic}
+        }]}]
+    }
+
+
+class DirectionsHandler(BaseHTTPRequestHandler):
+    """Servidor de direções falso: a origem da rota escolhe o comportamento"""
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            origin = parse_qs(urlparse(self.path).query)["origin"][0]
+            if origin == "slow":
+                time.sleep(SLOW_SECONDS)
+                self.reply(200, directions_body(600, 900))
+            elif origin == "error":
+                self.reply(500, {"status": "UNKNOWN_ERROR"})
+            else:
+                time.sleep(GOOD_DELAY_SECONDS)
+                self.reply(200, directions_body(600, 720))
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def reply(self, status, body):
+        payload = json.dumps(body).encode("utf-8")
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        except (BrokenPipeError, ConnectionResetError):
+            # O cliente desistiu da rota lenta por timeout
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def directions_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), DirectionsHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.in_flight = 0
+    server.max_in_flight = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def etl_traffic(directions_server, monkeypatch):
+    monkeypatch.setenv("DIRECTIONS_API_URL", f"http://127.0.0.1:{directions_server.server_port}/directions/json")
+    monkeypatch.setenv("GOOGLE_MAPS_API_KEY", "test-key")
+    from pipelines import etl_traffic
+    yield importlib.reload(etl_traffic)
+    monkeypatch.undo()
+    importlib.reload(etl_traffic)
+
+
+def route(origin, index=0):
+    return {"origin": origin, "destination": f"destino {index}", "city": "São Paulo"}
+
+
+def test_fetch_traffic_data_splits_successes_and_failures(etl_traffic):
+    routes = [route("good", 0), route("slow"), route("error"), route("good", 1)]
+    session = etl_traffic.create_session(pool_size=4, max_retries=0)
+
+    data, failures = etl_traffic.fetch_traffic_data(routes, max_workers=4, session=session, timeout=(1, 0.3))
+    session.close()
+
+    assert sorted(record["destination"] for record in data) == ["destino 0", "destino 1"]
+    assert all(record["delay"] == 120 for record in data)
+    assert len({record["timestamp"] for record in data}) == 1
+    assert sorted(failure["origin"] for failure in failures) == ["error", "slow"]
+    assert all(failure["error"] for failure in failures)
+
+
+def test_fetch_traffic_data_timeout_bounds_slow_route(etl_traffic):
+    session = etl_traffic.create_session(pool_size=1, max_retries=0)
+
+    started = time.perf_counter()
+    data, failures = etl_traffic.fetch_traffic_data([route("slow")], max_workers=1, session=session,
+                                                    timeout=(1, 0.2))
+    elapsed = time.perf_counter() - started
+    session.close()
+
+    assert data == []
+    assert [failure["origin"] for failure in failures] == ["slow"]
+    assert "timed out" in failures[0]["error"].lower()
+    assert elapsed < SLOW_SECONDS
+
+
+def test_fetch_traffic_data_bounds_concurrency(etl_traffic, directions_server):
+    routes = [route("good", i) for i in range(12)]
+    session = etl_traffic.create_session(pool_size=3, max_retries=0)
+
+    data, failures = etl_traffic.fetch_traffic_data(routes, max_workers=3, session=session, timeout=(1, 2))
+    session.close()
+
+    assert len(data) == 12
+    assert failures == []
+    assert 1 < directions_server.max_in_flight <= 3
+
+
+def test_run_traffic_etl_skips_without_api_key(etl_traffic, directions_server, monkeypatch):
+    monkeypatch.setattr(etl_traffic, "GOOGLE_MAPS_API_KEY", None)
+
+    result = etl_traffic.run_traffic_etl([route("good")])
+
+    assert result["status"] == "skipped"
+    assert directions_server.max_in_flight == 0
+    with pytest.raises(RuntimeError, match="GOOGLE_MAPS_API_KEY"):
+        etl_traffic.fetch_traffic_data([route("good")])